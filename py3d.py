@@ -10,6 +10,7 @@ but it is small, light, and can create some neat stuff in a portable environment
 
 ## Requires:
 PIL or Pillow - used for rendering the final image, but shouldn't be too difficult to remove that dependency in the future.
+Optionally numpy - for the much faster numpy rendering backend.
 
 ## Status:
 Still early alpha development.
@@ -47,23 +48,72 @@ Some learning/reference resources that can be used:
 """
 
 #IMPORTS
-import math, os, sys
+import math, os, sys, io
+import bisect, mmap, random, struct
+import multiprocessing
+from collections import OrderedDict
 from math import sqrt, pow, pi
 import time
+from array import array
 import PIL,PIL.Image
+try:
+	import numpy
+except ImportError:
+	numpy = None
 
 #PYTHON VERSION CHECKING
 PYTHON3 = int(sys.version[0]) == 3
 if PYTHON3:
         xrange = range
 
+#time.clock was removed in Python 3.8
+timer = getattr(time, "perf_counter", None) or time.clock
+
+#SLOTS
+class _SlotsMetaclass(type):
+	"""
+	Like the one in euclid, gives classes that use __slots__ a __getstate__ and __setstate__
+	covering the slots of all their baseclasses, so they can still be pickled (eg when
+	sending a scene to worker processes).
+	"""
+	def __new__(cls, name, bases, dct):
+		newcls = type.__new__(cls, name, bases, dct)
+		slots = []
+		for basecls in reversed(newcls.__mro__):
+			slots.extend(basecls.__dict__.get("__slots__", ()))
+		if slots:
+			newcls.__getstate__ = cls._create_getstate(slots)
+			newcls.__setstate__ = cls._create_setstate(slots)
+		return newcls
+
+	@classmethod
+	def _create_getstate(cls, slots):
+		def __getstate__(self):
+			d = {}
+			for slot in slots:
+				d[slot] = getattr(self, slot)
+			return d
+		return __getstate__
+
+	@classmethod
+	def _create_setstate(cls, slots):
+		def __setstate__(self, state):
+			for name, value in state.items():
+				setattr(self, name, value)
+		return __setstate__
+
+#works as a base class with the metaclass in both python 2 and 3
+_Slots = _SlotsMetaclass("_Slots", (object,), {"__slots__": ()})
+
 #GEOMETRIES
-class Vector( object ):
+class Vector( _Slots ):
 	"""
 	The basic building block indicating a 3D point coordinate position. It is a vector/arrow only in the sense that it starts at the zeropoint 0,0,0 and moves to the coordinates given.
 
 	- x/y/z: the xyz coordinates of the point.
 	"""
+	__slots__ = ("x", "y", "z")
+
 	def __init__(self,x,y,z):
 		self.x = float(x)
 		self.y = float(y)
@@ -80,21 +130,339 @@ class Vector( object ):
 		
 	def normal(self):
 		mag = self.magnitude()
-		return Vector(self.x/mag,self.y/mag,self.z/mag)
+		return _vector(self.x/mag,self.y/mag,self.z/mag)
 
 	def __repr__(self):
 		return str((self.x, self.y, self.z))
 		
 	def __add__(self, b):
-		return Vector(self.x + b.x, self.y+b.y, self.z+b.z)
+		return _vector(self.x + b.x, self.y+b.y, self.z+b.z)
 	
 	def __sub__(self, b):
-		return Vector(self.x-b.x, self.y-b.y, self.z-b.z)
+		return _vector(self.x-b.x, self.y-b.y, self.z-b.z)
 		
 	def __mul__(self, b):
 		assert type(b) == float or type(b) == int
-		return Vector(self.x*b, self.y*b, self.z*b)		
+		return _vector(self.x*b, self.y*b, self.z*b)		
+
+	#in-place versions of the above, which change and return the vector itself instead of creating a new one
+	def iadd(self, b):
+		self.x += b.x
+		self.y += b.y
+		self.z += b.z
+		return self
+
+	def isub(self, b):
+		self.x -= b.x
+		self.y -= b.y
+		self.z -= b.z
+		return self
+
+	def imul(self, b):
+		self.x *= b
+		self.y *= b
+		self.z *= b
+		return self
+
+	def normalize_(self):
+		mag = self.magnitude()
+		self.x /= mag
+		self.y /= mag
+		self.z /= mag
+		return self
+
+def _vector(x, y, z, _new=object.__new__):
+	"""
+	Fast Vector constructor for internal use, skips the float conversion so the coordinates must already be floats.
+	"""
+	vector = _new(Vector)
+	vector.x = x
+	vector.y = y
+	vector.z = z
+	return vector
+
+class Matrix4( _Slots ):
+	"""
+	A 4x4 transform matrix, laid out like the Matrix4 of euclid with the rows a b c d, e f g h,
+	i j k l and m n o p, and the translation in d, h and l. Starts out as the identity matrix.
+	Combine transforms by multiplying them, where the rightmost one is applied first, eg
+	Matrix4.new_translate(0,0,5) * Matrix4.new_rotatez(pi/2) * Matrix4.new_scale(2,2,2)
+	"""
+	__slots__ = list("abcdefghijklmnop")
+
+	def __init__(self):
+		self.a = self.f = self.k = self.p = 1.0
+		self.b = self.c = self.d = self.e = self.g = self.h = \
+		self.i = self.j = self.l = self.m = self.n = self.o = 0.0
+
+	def __repr__(self):
+		return "Matrix4(%s)" % ", ".join(str(getattr(self, slot)) for slot in self.__slots__)
+
+	def __mul__(self, other):
+		M = Matrix4()
+		A,B = self,other
+		for row in ("abcd", "efgh", "ijkl", "mnop"):
+			r0,r1,r2,r3 = [getattr(A, slot) for slot in row]
+			for col,slot in zip(("aeim", "bfjn", "cgko", "dhlp"), row):
+				c0,c1,c2,c3 = [getattr(B, name) for name in col]
+				setattr(M, slot, r0*c0 + r1*c1 + r2*c2 + r3*c3)
+		return M
+
+	@classmethod
+	def new_scale(cls, x, y, z):
+		M = cls()
+		M.a,M.f,M.k = x,y,z
+		return M
+
+	@classmethod
+	def new_translate(cls, x, y, z):
+		M = cls()
+		M.d,M.h,M.l = x,y,z
+		return M
+
+	@classmethod
+	def new_rotatex(cls, angle):
+		M = cls()
+		s,c = math.sin(angle),math.cos(angle)
+		M.f = M.k = c
+		M.g,M.j = -s,s
+		return M
+
+	@classmethod
+	def new_rotatey(cls, angle):
+		M = cls()
+		s,c = math.sin(angle),math.cos(angle)
+		M.a = M.k = c
+		M.c,M.i = s,-s
+		return M
+
+	@classmethod
+	def new_rotatez(cls, angle):
+		M = cls()
+		s,c = math.sin(angle),math.cos(angle)
+		M.a = M.f = c
+		M.b,M.e = -s,s
+		return M
+
+	def transform(self, point):
+		"""
+		The point moved by the whole transform, including the translation.
+		"""
+		x,y,z = point.x,point.y,point.z
+		return _vector(self.a*x + self.b*y + self.c*z + self.d,
+			       self.e*x + self.f*y + self.g*z + self.h,
+			       self.i*x + self.j*y + self.k*z + self.l)
+
+	def transformdirection(self, vector):
+		"""
+		The direction turned and scaled by the transform, without the translation.
+		"""
+		x,y,z = vector.x,vector.y,vector.z
+		return _vector(self.a*x + self.b*y + self.c*z,
+			       self.e*x + self.f*y + self.g*z,
+			       self.i*x + self.j*y + self.k*z)
+
+	def transposed(self):
+		M = Matrix4()
+		for row,col in zip(("abcd", "efgh", "ijkl", "mnop"), ("aeim", "bfjn", "cgko", "dhlp")):
+			for slot,name in zip(row, col):
+				setattr(M, slot, getattr(self, name))
+		return M
+
+	def inverse(self):
+		"""
+		The inverse of the transform, assuming it only moves, turns and scales (ie the bottom row is 0 0 0 1).
+		"""
+		a,b,c,d,e,f,g,h,i,j,k,l = [getattr(self, slot) for slot in "abcdefghijkl"]
+		det = a*(f*k-g*j) - b*(e*k-g*i) + c*(e*j-f*i)
+		if det == 0:
+			raise ValueError("matrix cannot be inverted")
+		M = Matrix4()
+		M.a,M.b,M.c = (f*k-g*j)/det, (c*j-b*k)/det, (b*g-c*f)/det
+		M.e,M.f,M.g = (g*i-e*k)/det, (a*k-c*i)/det, (c*e-a*g)/det
+		M.i,M.j,M.k = (e*j-f*i)/det, (b*i-a*j)/det, (a*f-b*e)/det
+		M.d = -(M.a*d + M.b*h + M.c*l)
+		M.h = -(M.e*d + M.f*h + M.g*l)
+		M.l = -(M.i*d + M.j*h + M.k*l)
+		return M
     
+#TEXTURES
+class Texture( object ):
+	"""
+	An image decoded once into a flat buffer of RGB bytes, for fast texel lookups.
+
+	- img: a PIL image
+	"""
+	def __init__(self, img):
+		img = img.convert("RGB")
+		self.width, self.height = img.size
+		self.data = bytearray(img.tobytes())
+
+	def texel(self, x, y):
+		i = 3*(y*self.width + x)
+		data = self.data
+		return data[i], data[i+1], data[i+2]
+
+	def array(self):
+		"""
+		A (height,width,3) numpy view of the texels.
+		"""
+		return numpy.frombuffer(self.data, dtype=numpy.uint8).reshape(self.height,self.width,3)
+
+	def mipmaps(self):
+		"""
+		The texture followed by ever smaller versions of itself, each half the size of the
+		previous one, down to a single texel. Created the first time they are needed.
+		"""
+		if getattr(self, "_mipmaps", None) is None:
+			levels = [self]
+			img = PIL.Image.frombytes("RGB", (self.width,self.height), bytes(self.data))
+			while img.size != (1,1):
+				#each texel the average of the 2x2 texels below it
+				img = img.resize((max(img.size[0]//2,1), max(img.size[1]//2,1)), PIL.Image.BOX)
+				levels.append(Texture(img))
+			self._mipmaps = levels
+		return self._mipmaps
+
+	def sample(self, u, v, lod):
+		"""
+		The trilinear filtered color at texture coordinates u,v (from 0 to 1), blending the two
+		mipmap levels around lod (0 is the full size texture, 1 the half size one, etc).
+		"""
+		if _stats is not None:
+			_stats.texturelookups += 1
+		levels = self.mipmaps()
+		if lod <= 0:
+			return levels[0].bilinear(u, v)
+		elif lod >= len(levels)-1:
+			return levels[-1].bilinear(u, v)
+		lower = int(lod)
+		frac = lod - lower
+		r1,g1,b1 = levels[lower].bilinear(u, v)
+		r2,g2,b2 = levels[lower+1].bilinear(u, v)
+		return (r1+(r2-r1)*frac, g1+(g2-g1)*frac, b1+(b2-b1)*frac)
+
+	def bilinear(self, u, v):
+		"""
+		The color at texture coordinates u,v (from 0 to 1) blended from the four nearest texels.
+		Wraps around horizontally, like the longitudes of a sphere.
+		"""
+		width,height = self.width,self.height
+		x = u*width - 0.5
+		y = v*height - 0.5
+		x1 = int(math.floor(x))
+		y1 = int(math.floor(y))
+		fx = x - x1
+		fy = y - y1
+		x2 = (x1+1) % width
+		x1 = x1 % width
+		y2 = min(max(y1+1, 0), height-1)
+		y1 = min(max(y1, 0), height-1)
+		r11,g11,b11 = self.texel(x1,y1)
+		r21,g21,b21 = self.texel(x2,y1)
+		r12,g12,b12 = self.texel(x1,y2)
+		r22,g22,b22 = self.texel(x2,y2)
+		w11 = (1-fx)*(1-fy)
+		w21 = fx*(1-fy)
+		w12 = (1-fx)*fy
+		w22 = fx*fy
+		return (r11*w11 + r21*w21 + r12*w12 + r22*w22,
+			g11*w11 + g21*w21 + g12*w12 + g22*w22,
+			b11*w11 + b21*w21 + b12*w12 + b22*w22)
+
+	def samplearray(self, u, v, lod):
+		"""
+		The array version of sample, for arrays of u, v and lod values. Returns an (n,3) float array.
+		"""
+		if _stats is not None:
+			_stats.texturelookups += len(u)
+		levels = self.mipmaps()
+		lod = numpy.clip(lod, 0, len(levels)-1)
+		colors = numpy.zeros((len(u),3))
+		for index,level in enumerate(levels):
+			weight = 1 - numpy.abs(lod - index)
+			sel = numpy.nonzero(weight > 0)[0]
+			if len(sel):
+				colors[sel] += weight[sel][:,None] * level.bilineararray(u[sel], v[sel])
+		return colors
+
+	def bilineararray(self, u, v):
+		"""
+		The array version of bilinear. Returns an (n,3) float array.
+		"""
+		width,height = self.width,self.height
+		x = u*width - 0.5
+		y = v*height - 0.5
+		x1 = numpy.floor(x)
+		y1 = numpy.floor(y)
+		fx = (x - x1)[:,None]
+		fy = (y - y1)[:,None]
+		x1 = x1.astype(int)
+		y1 = y1.astype(int)
+		x2 = (x1+1) % width
+		x1 = x1 % width
+		y2 = numpy.clip(y1+1, 0, height-1)
+		y1 = numpy.clip(y1, 0, height-1)
+		texels = self.array()
+		return (texels[y1,x1]*(1-fx)*(1-fy) + texels[y1,x2]*fx*(1-fy)
+			+ texels[y2,x1]*(1-fx)*fy + texels[y2,x2]*fx*fy)
+
+class TextureCache( object ):
+	"""
+	Keeps decoded textures by filepath and modification time, so each image file is only
+	read and decoded once no matter how many geometries use it. When the textures take up
+	more than maxbytes the least recently loaded ones are dropped from the cache.
+
+	- *maxbytes: the max size of all cached textures
+	"""
+	def __init__(self, maxbytes=256*1024*1024):
+		self.maxbytes = maxbytes
+		self.nbytes = 0
+		self._textures = OrderedDict()
+
+	def load(self, imgpath):
+		imgpath = os.path.abspath(imgpath)
+		key = (imgpath, os.path.getmtime(imgpath))
+		texture = self._textures.pop(key, None)
+		if texture is None:
+			#forget older versions of the same file
+			for oldkey in [oldkey for oldkey in self._textures if oldkey[0] == imgpath]:
+				self._drop(oldkey)
+			texture = Texture(PIL.Image.open(imgpath))
+			self.nbytes += len(texture.data)
+		self._textures[key] = texture
+		while self.nbytes > self.maxbytes and len(self._textures) > 1:
+			self._drop(next(iter(self._textures)))
+		return texture
+
+	def clear(self):
+		self._textures.clear()
+		self.nbytes = 0
+
+	def _drop(self, key):
+		self.nbytes -= len(self._textures.pop(key).data)
+
+#shared by every geometry in this process
+TEXTURES = TextureCache()
+
+class Material( object ):
+	"""
+	How much of the light that falls on a geometry is mirrored or let through by its surface, given
+	to a geometry as its material. The color of the geometry itself makes up the rest, eg a surface
+	with a reflectivity of 0.8 shows the scene mirrored in it over 20% of its own color. Transparent
+	geometries still cast full shadows.
+
+	- *reflectivity: the fraction of light mirrored, from 0 to 1
+	- *transparency: the fraction of light let through, from 0 to 1
+	- *refraction: the index of refraction of the inside of the geometry, how much it bends the light let through, eg 1.0 for not at all, 1.33 for water and 1.5 for glass
+	"""
+	def __init__(self, reflectivity=0.0, transparency=0.0, refraction=1.5):
+		if reflectivity < 0 or transparency < 0 or reflectivity + transparency > 1:
+			raise ValueError("reflectivity and transparency must be at least 0 and add up to at most 1")
+		self.reflectivity = reflectivity
+		self.transparency = transparency
+		self.refraction = refraction
+
 class Sphere( object ):
 	"""
         A ball-looking object, the 3d equivalent of a circle.
@@ -102,40 +470,95 @@ class Sphere( object ):
         - center: a vector of the center of the sphere
         - radius: the radius of the sphere measured in the same coordinate system as the vectors
         - color: a color instance (only matters if you don't give the sphere a texture
-        - texture: the filepath to an imagefile to use as a texture (to wrap around the sphere). For now only takes gif files.
+        - texture: the filepath to an imagefile to use as a texture (to wrap around the sphere). Any image format that PIL can read.
         - spintop: a vector indicating the "north" top of the sphere around which the sphere may spin, which impacts how and where the texture will be mapped.
 	- facing: a vector indicating towards which direction its spin should be facing. Ccurrently not working properly bc have to fix normalization, so it is up to the user to make sure this argument is at right angles with the spintop/"north", ie pointing to somewhere along "the equator".
+	- *material: a material instance if the sphere should mirror or let through light
 	"""
 	
-	def __init__(self, center, radius, color, texture=None, spintop=Vector(0,0,1.0), facing="not specified"):
+	def __init__(self, center, radius, color, texture=None, spintop=Vector(0,0,1.0), facing="not specified", material=None):
 		self.c = center
 		self.r = radius
 		self.col = color
+		self.material = material
 		self.spintop = spintop #if not specified looks upwards to z
 		if facing == "not specified": self.facing = self.normal(spintop) #note, this one becomes normalized so makes error later on
 		else: self.facing = facing
 		if texture: self.addtexture(texture)
 		else: self.texture = None
 		
-	def intersection(self, l):
-		q = l.d.dot(l.o - self.c)**2 - (l.o - self.c).dot(l.o - self.c) + self.r**2
+	def hit(self, l):
+		o,d,c = l.o,l.d,self.c
+		ocx,ocy,ocz = o.x-c.x, o.y-c.y, o.z-c.z
+		b = d.x*ocx + d.y*ocy + d.z*ocz
+		q = b**2 - (ocx*ocx + ocy*ocy + ocz*ocz) + self.r**2
 		if q < 0:
-			return Intersection( Vector(0,0,0), -1, Vector(0,0,0), self)
+			return NOHIT
 		else:
-			d = -l.d.dot(l.o - self.c)
-			d1 = d - sqrt(q)
-			d2 = d + sqrt(q)
+			root = sqrt(q)
+			d1 = -b - root
+			d2 = -b + root
 			if 0 < d1 and ( d1 < d2 or d2 < 0):
-				return Intersection(l.o+l.d*d1, d1, self.normal(l.o+l.d*d1), self)
+				return d1
 			elif 0 < d2 and ( d2 < d1 or d1 < 0):
-				return Intersection(l.o+l.d*d2, d2, self.normal(l.o+l.d*d2), self)
+				return d2
 			else:
-				return Intersection( Vector(0,0,0), -1, Vector(0,0,0), self)	
+				return NOHIT
+
+	def intersection(self, l):
+		return _intersection(l, self.hit(l), self)
 			
 	def normal(self, b):
-		return (b - self.c).normal()
+		c = self.c
+		return _vector(b.x-c.x, b.y-c.y, b.z-c.z).normalize_()
+
+	def bbox(self):
+		c,r = self.c,self.r
+		return (c.x-r, c.y-r, c.z-r, c.x+r, c.y+r, c.z+r)
+
+	def hitarray(self, origins, dirs):
+		oc = origins - _vecarray(self.c)
+		b = (dirs*oc).sum(axis=-1)
+		q = b*b - (oc*oc).sum(axis=-1) + self.r**2
+		with numpy.errstate(invalid="ignore"):
+			root = numpy.sqrt(q)
+		d1 = -b - root
+		d2 = -b + root
+		t = numpy.where(d1 > 0, d1, d2)
+		return numpy.where((q > 0) & (t > 0), t, numpy.inf)
+
+	def normalarray(self, points):
+		diff = points - _vecarray(self.c)
+		return diff / numpy.sqrt((diff*diff).sum(axis=1))[:,None]
+
+	def colorarray(self, points, footprints=None):
+		if self.texture:
+			#same mapping as getcolor
+			points = self.normalarray(points)
+			north = _vecarray(self.spintop.normal())
+			equator = _vecarray(self.facing)
+			phi = numpy.arccos(numpy.clip(-points.dot(north), -1, 1))
+			v = phi / math.pi
+			sinphi = numpy.sin(phi)
+			cosinput = points.dot(equator) / numpy.where(sinphi == 0, 0.0000001, sinphi)
+			theta = numpy.arccos(numpy.clip(cosinput, -1, 1)) / (2 * math.pi)
+			u = numpy.where(points.dot(numpy.cross(north,equator)) > 0, theta, 1 - theta)
+			if footprints is not None:
+				lod = numpy.log2(numpy.maximum(footprints/self._texelsize(), 1e-12))
+				return self.texture.samplearray(u, v, lod)
+			if _stats is not None:
+				_stats.texturelookups += len(points)
+			imgwidth,imgheight = self.texture.width-1, self.texture.height-1
+			texels = self.texture.array()[(v*imgheight).astype(int), (u*imgwidth).astype(int)]
+			return texels.astype(float)
+		else:
+			return numpy.tile(_vecarray(self.col), (len(points),1))
 
-	def getcolor(self, point):
+	def getcolor(self, point, footprint=None):
+		"""
+		The color at a point on the surface. When given the footprint, ie the width of surface that
+		the pixel covers at that point, the texture is sampled from the matching mipmap level.
+		"""
 		if self.texture:
 			"based on this one, http://ray-tracer-concept.blogspot.no/2011/12/texture-mapping.html"
 			center = self.c
@@ -166,17 +589,23 @@ class Sphere( object ):
 				u = theta 
 			else:
 				u = 1 - theta
-			imgwidth,imgheight = self.texture.width()-1, self.texture.height()-1
+			if footprint is not None:
+				lod = math.log(max(footprint/self._texelsize(), 1e-12), 2)
+				return _vector(*self.texture.sample(u, v, lod))
+			if _stats is not None:
+				_stats.texturelookups += 1
+			imgwidth,imgheight = self.texture.width-1, self.texture.height-1
 			pixeltoget = (int(u*imgwidth), int(v*imgheight))
-			color = map(int,self.texture.get(*pixeltoget).split())
-			return Vector(*color)
+			return Vector(*self.texture.texel(*pixeltoget))
 		else:
 			return self.col
 
 	def addtexture(self, imgpath):
-		import Tkinter as tk
-		tempwin = tk.Tk()
-		self.texture = tk.PhotoImage(file=imgpath)
+		self.texture = TEXTURES.load(imgpath)
+
+	def _texelsize(self):
+		#the surface width covered by one full size texel, the texture spans the circumference horizontally and half of it vertically
+		return max(2*pi*self.r/self.texture.width, pi*self.r/self.texture.height)
 
 ##class Cylinder( object ):
 ##
@@ -216,28 +645,55 @@ class Plane( object ):
         - point: a vector of the centerpoint of the surface
         - normal: a vector towards which the plane centerpoint should be facing
         - color: a color instance
+        - *material: a material instance if the plane should mirror or let through light
         """
-	def __init__(self, point, normal, color):
+	def __init__(self, point, normal, color, material=None):
 		self.n = normal
 		self.p = point
 		self.col = color
+		self.material = material
 		
-	def intersection(self, ray):
-		dotprod = ray.d.dot(self.n)
+	def hit(self, ray):
+		o,d,n,p = ray.o,ray.d,self.n,self.p
+		dotprod = d.x*n.x + d.y*n.y + d.z*n.z
 		if dotprod == 0:
 			#a zero dotprod of two vectors means they are at right angles from each other
 			#meaning destination and plane normal direction are at right angles from each other
 			#meaning ray will travel along the surface of the plane and never hit it
-			return Intersection( Vector(0,0,0), -1, Vector(0,0,0), self)
+			return NOHIT
 		else:
-			hitanglevector = self.p - ray.o #the normal/perpendicular/diff vector bw hitorigin vector and the surface direction vector
-			partdotprod = hitanglevector.dot(self.n) #the ray's hit impact on the plane given its angle?
+			#dot of the plane normal with the normal/perpendicular/diff vector bw hitorigin vector and the surface direction vector
+			partdotprod = (p.x-o.x)*n.x + (p.y-o.y)*n.y + (p.z-o.z)*n.z #the ray's hit impact on the plane given its angle?
 			transferratio =  partdotprod / dotprod #how much impact at hitpoint vs original full ray power
-			hitpoint = ray.d*transferratio #scale the ray backwards by the ratio to get the relative hitpoint
-			worldhitpoint = ray.o+hitpoint #and back to absolute world coordinates
-			return Intersection(worldhitpoint, transferratio, self.n, self)
+			if transferratio > 0:
+				return transferratio
+			return NOHIT
+
+	def intersection(self, ray):
+		return _intersection(ray, self.hit(ray), self)
+
+	def normal(self, point):
+		return self.n
+
+	def bbox(self):
+		#infinite, so cannot be bounded and has to be tested separately
+		return None
 
-	def getcolor(self, point):
+	def hitarray(self, origins, dirs):
+		n = _vecarray(self.n)
+		dotprod = dirs.dot(n)
+		partdotprod = (_vecarray(self.p) - origins).dot(n)
+		with numpy.errstate(divide="ignore", invalid="ignore"):
+			transferratio = partdotprod / dotprod
+		return numpy.where((dotprod != 0) & (transferratio > 0), transferratio, numpy.inf)
+
+	def normalarray(self, points):
+		return numpy.tile(_vecarray(self.n), (len(points),1))
+
+	def colorarray(self, points, footprints=None):
+		return numpy.tile(_vecarray(self.col), (len(points),1))
+
+	def getcolor(self, point, footprint=None):
 		return self.col
 
 class Rectangle( Plane ):
@@ -247,8 +703,9 @@ class Rectangle( Plane ):
 	
 	- width/height: makes no difference, only uses width to create equisquare
 	- spin: currently not being used
+	- *material: a material instance if the rectangle should mirror or let through light
 	"""
-	def __init__(self, point, normal, width, height, color, spin="not specified"):
+	def __init__(self, point, normal, width, height, color, spin="not specified", material=None):
 		self.n = normal
 		self.p = point
 		self.halfwidth = width/2.0
@@ -256,26 +713,988 @@ class Rectangle( Plane ):
 		if spin == "not specified": self.spin = Vector(0,0,1)
 		else: self.spin = spin
 		self.col = color
+		self.material = material
 		
+	def hit(self, ray):
+		transferratio = Plane.hit(self, ray)
+		if transferratio == NOHIT:
+			return NOHIT
+		#scale the ray by the ratio to get the hitpoint in world coordinates
+		o,d,p,h = ray.o,ray.d,self.p,self.halfwidth
+		x = o.x+d.x*transferratio
+		y = o.y+d.y*transferratio
+		z = o.z+d.z*transferratio
+		if p.x-h < x < p.x+h and p.y-h < y < p.y+h and p.z-h < z < p.z+h:
+			return transferratio
+		else:
+			return NOHIT
+
+	def bbox(self):
+		#same equisquare limits as tested in intersection
+		p,h = self.p,self.halfwidth
+		return (p.x-h, p.y-h, p.z-h, p.x+h, p.y+h, p.z+h)
+
+	def hitarray(self, origins, dirs):
+		t = Plane.hitarray(self, origins, dirs)
+		hit = numpy.isfinite(t)
+		worldhitpoints = origins + dirs * numpy.where(hit, t, 0)[:,None]
+		offsets = numpy.abs(worldhitpoints - _vecarray(self.p))
+		inside = (offsets < self.halfwidth).all(axis=1)
+		return numpy.where(hit & inside, t, numpy.inf)
+
+class TriangleMesh( object ):
+	"""
+	A surface made of triangles, eg a model loaded from a Wavefront OBJ file with TriangleMesh.fromobj.
+	Keeps its vertices and triangles in flat typed arrays, and builds its own bounding volume hierarchy
+	over the triangles, so that it can be given to testRay as a single geometry. Only supported by the
+	python backend.
+
+	- vertices: a flat sequence of the x,y,z coordinates of each vertex
+	- triangles: a flat sequence of the indexes of the three vertices of each triangle, counterclockwise when seen from the front
+	- color: a color instance
+	- *leafsize: the max nr of triangles in each of the outermost boxes of its hierarchy
+	- *material: a material instance if the mesh should mirror or let through light
+	"""
+	def __init__(self, vertices, triangles, color, leafsize=4, material=None):
+		self.vertices = array("d", vertices)
+		triangles = array("I", triangles)
+		self.col = color
+		self.material = material
+		count = len(triangles)//3
+		verts = self.vertices
+		boxes = array("d")
+		for k in xrange(count):
+			a,b,c = 3*triangles[3*k],3*triangles[3*k+1],3*triangles[3*k+2]
+			xs = verts[a],verts[b],verts[c]
+			ys = verts[a+1],verts[b+1],verts[c+1]
+			zs = verts[a+2],verts[b+2],verts[c+2]
+			boxes.extend((min(xs),min(ys),min(zs),max(xs),max(ys),max(zs)))
+		self.bounds, self.firsts, self.sizes, self.axes, order = _buildBVH(boxes, count, leafsize)
+		#stored in leaf order so each leaf is a run of triangles
+		self.triangles = array("I")
+		for k in order:
+			self.triangles.extend(triangles[3*k:3*k+3])
+
+	@classmethod
+	def fromobj(cls, filepath, color, leafsize=4, material=None):
+		"""
+		Loads the vertices and faces of a Wavefront OBJ file as a triangle mesh. Faces with more
+		than three vertices are split into triangles, and everything else in the file is ignored.
+
+		- filepath: the path of the OBJ file
+		- color: a color instance
+		- *leafsize: see TriangleMesh
+		- *material: see TriangleMesh
+		"""
+		vertices = array("d")
+		triangles = array("I")
+		with open(filepath) as reader:
+			for line in reader:
+				parts = line.split()
+				if not parts:
+					continue
+				if parts[0] == "v":
+					vertices.extend((float(parts[1]), float(parts[2]), float(parts[3])))
+				elif parts[0] == "f":
+					#vertex/texture/normal indexes starting at 1, or negative counting from the last vertex so far
+					indexes = []
+					for part in parts[1:]:
+						index = int(part.split("/")[0])
+						indexes.append(index-1 if index > 0 else len(vertices)//3 + index)
+					for i in xrange(1, len(indexes)-1):
+						triangles.extend((indexes[0], indexes[i], indexes[i+1]))
+		return cls(vertices, triangles, color, leafsize, material)
+
+	def __len__(self):
+		return len(self.triangles)//3
+
+	def hit(self, ray):
+		"""
+		Returns the distance to the closest triangle hit beyond EPSILON, and keeps the triangle that was hit as lasthit.
+		"""
+		best,index = self._traverse(ray, EPSILON, float("inf"), False)
+		self.lasthit = _MeshTriangle(self, index) if index is not None else None
+		return best
+
+	def intersect(self, ray, ignore=None):
+		best,index = self._traverse(ray, 0, float("inf"), False)
+		if index is None:
+			return NOINTERSECTION
+		return _intersection(ray, best, _MeshTriangle(self, index))
+
+	def occluded(self, ray, tmax, ignore=None):
+		return self._traverse(ray, EPSILON, tmax, True)[1] is not None
+
 	def intersection(self, ray):
-		dotprod = ray.d.dot(self.n)
-		if dotprod == 0:
-			#a zero dotprod of two vectors means they are at right angles from each other
-			#meaning destination and plane normal direction are at right angles from each other
-			#meaning ray will travel along the surface of the plane and never hit it
-			return Intersection( Vector(0,0,0), -1, Vector(0,0,0), self)
+		return self.intersect(ray)
+
+	def bbox(self):
+		return tuple(self.bounds[0:6])
+
+	def _traverse(self, ray, tmin, tmax, anyhit):
+		#the closest triangle hit between tmin and tmax, or with anyhit the first one found
+		ox,oy,oz = ray.o.x,ray.o.y,ray.o.z
+		dx,dy,dz = ray.d.x,ray.d.y,ray.d.z
+		ix = 1.0/dx if dx else 1e300
+		iy = 1.0/dy if dy else 1e300
+		iz = 1.0/dz if dz else 1e300
+		negative = (dx < 0, dy < 0, dz < 0)
+		bounds,firsts,sizes,axes = self.bounds,self.firsts,self.sizes,self.axes
+		verts,tris = self.vertices,self.triangles
+		stats = _stats
+		best = tmax
+		bestindex = None
+		stack = [0] if tris else []
+		while stack:
+			node = stack.pop()
+			b = 6*node
+			t1 = (bounds[b]-ox)*ix
+			t2 = (bounds[b+3]-ox)*ix
+			if t1 > t2: t1,t2 = t2,t1
+			t3 = (bounds[b+1]-oy)*iy
+			t4 = (bounds[b+4]-oy)*iy
+			if t3 > t4: t3,t4 = t4,t3
+			if t3 > t1: t1 = t3
+			if t4 < t2: t2 = t4
+			t3 = (bounds[b+2]-oz)*iz
+			t4 = (bounds[b+5]-oz)*iz
+			if t3 > t4: t3,t4 = t4,t3
+			if t3 > t1: t1 = t3
+			if t4 < t2: t2 = t4
+			if t2 < t1 or t2 < 0 or t1 > best:
+				continue
+			size = sizes[node]
+			if size:
+				first = firsts[node]
+				if stats is not None: stats.testnamed("Triangle", size)
+				for k in xrange(first, first+size):
+					#moller-trumbore ray triangle test
+					a,v1,v2 = 3*tris[3*k],3*tris[3*k+1],3*tris[3*k+2]
+					ax,ay,az = verts[a],verts[a+1],verts[a+2]
+					e1x,e1y,e1z = verts[v1]-ax,verts[v1+1]-ay,verts[v1+2]-az
+					e2x,e2y,e2z = verts[v2]-ax,verts[v2+1]-ay,verts[v2+2]-az
+					px,py,pz = dy*e2z-dz*e2y, dz*e2x-dx*e2z, dx*e2y-dy*e2x
+					det = e1x*px + e1y*py + e1z*pz
+					if -1e-12 < det < 1e-12:
+						#parallel to the triangle
+						continue
+					inv = 1.0/det
+					sx,sy,sz = ox-ax,oy-ay,oz-az
+					#a little beyond the edges, so rays cannot slip between neighbouring triangles
+					u = (sx*px + sy*py + sz*pz)*inv
+					if u < -1e-9 or u > 1+1e-9:
+						continue
+					qx,qy,qz = sy*e1z-sz*e1y, sz*e1x-sx*e1z, sx*e1y-sy*e1x
+					v = (dx*qx + dy*qy + dz*qz)*inv
+					if v < -1e-9 or u+v > 1+1e-9:
+						continue
+					t = (e2x*qx + e2y*qy + e2z*qz)*inv
+					if tmin < t < best:
+						best = t
+						bestindex = k
+						if anyhit:
+							return best,bestindex
+			else:
+				#visit the child nearest along the split axis first
+				left = firsts[node]
+				if negative[axes[node]]:
+					stack.append(left)
+					stack.append(left+1)
+				else:
+					stack.append(left+1)
+					stack.append(left)
+		if bestindex is None:
+			return NOHIT,None
+		return best,bestindex
+
+class _MeshTriangle( object ):
+	#a single triangle of a mesh, what the mesh keeps as lasthit so it can be shaded
+	__slots__ = ("mesh", "index")
+
+	def __init__(self, mesh, index):
+		self.mesh = mesh
+		self.index = index
+
+	def corners(self):
+		verts,tris = self.mesh.vertices,self.mesh.triangles
+		return [_vector(verts[3*v],verts[3*v+1],verts[3*v+2]) for v in tris[3*self.index:3*self.index+3]]
+
+	def normal(self, point):
+		a,b,c = self.corners()
+		return _vector(*(b-a).cross(c-a)).normalize_()
+
+	def getcolor(self, point, footprint=None):
+		return self.mesh.col
+
+	@property
+	def material(self):
+		return self.mesh.material
+
+class Instance( object ):
+	"""
+	A copy of a geometry placed elsewhere in the scene, moved, turned and scaled by a transform.
+	Many instances can share the same geometry (eg a mesh, or a BVH of a group of geometries),
+	so that it is only stored and its hierarchy only built once. A BVH of instances then forms
+	a two level hierarchy, where moving an instance only requires calling build on the top one.
+
+	- geometry: the geometry instance to place
+	- transform: a Matrix4 instance from the coordinates of the geometry to those of the scene
+	"""
+	def __init__(self, geometry, transform):
+		self.geometry = geometry
+		self.settransform(transform)
+
+	def settransform(self, transform):
+		"""
+		Moves the instance to a new transform.
+		"""
+		self.transform = transform
+		self.inverse = transform.inverse()
+		#normals are turned by the inverse transpose, so they stay at right angles to stretched surfaces
+		self.normaltransform = self.inverse.transposed()
+		box = self.geometry.bbox()
+		if box is None:
+			self.box = None
 		else:
-			hitanglevector = self.p - ray.o #the normal/perpendicular/diff vector bw hitorigin vector and the surface direction vector
-			partdotprod = hitanglevector.dot(self.n) #the ray's hit impact on the plane given its angle?
-			transferratio =  partdotprod / dotprod #how much impact at hitpoint vs original full ray power
-			hitpoint = ray.d*transferratio #scale the ray backwards by the ratio to get the relative hitpoint
-			worldhitpoint = ray.o+hitpoint #and back to absolute world coordinates
-			if worldhitpoint.x > self.p.x-self.halfwidth and worldhitpoint.x < self.p.x+self.halfwidth \
-			   and worldhitpoint.y > self.p.y-self.halfwidth and worldhitpoint.y < self.p.y+self.halfwidth \
-			   and worldhitpoint.z > self.p.z-self.halfwidth and worldhitpoint.z < self.p.z+self.halfwidth:
-				return Intersection(worldhitpoint, transferratio, self.n, self)
+			#the box around the transformed corners of the geometry's box
+			corners = [transform.transform(_vector(x,y,z)) for x in (box[0],box[3]) for y in (box[1],box[4]) for z in (box[2],box[5])]
+			self.box = (min(p.x for p in corners), min(p.y for p in corners), min(p.z for p in corners),
+				    max(p.x for p in corners), max(p.y for p in corners), max(p.z for p in corners))
+
+	def _localray(self, ray):
+		#the ray in the coordinates of the geometry, and how much longer distances are there
+		direction = self.inverse.transformdirection(ray.d)
+		scale = direction.magnitude()
+		return Ray(self.inverse.transform(ray.o), direction.imul(1.0/scale)), scale
+
+	def hit(self, ray):
+		"""
+		Returns the distance to the hit in scene coordinates, and keeps what was hit as lasthit.
+		"""
+		local,scale = self._localray(ray)
+		d = self.geometry.hit(local)
+		if d == NOHIT:
+			return NOHIT
+		self.lasthit = _InstanceHit(self, getattr(self.geometry, "lasthit", self.geometry), scale)
+		return d / scale
+
+	def occluded(self, ray, tmax, ignore=None):
+		"""
+		Whether the geometry blocks the ray before it has travelled the distance tmax in scene coordinates.
+		"""
+		local,scale = self._localray(ray)
+		return _blocks(self.geometry, local, tmax*scale)
+
+	def intersection(self, ray):
+		d = self.hit(ray)
+		return _intersection(ray, d, self.lasthit if d != NOHIT else self)
+
+	def bbox(self):
+		return self.box
+
+	@property
+	def material(self):
+		return getattr(self.geometry, "material", None)
+
+	def hitarray(self, origins, dirs):
+		localdirs = _transformarray(self.inverse, dirs, False)
+		scales = numpy.sqrt((localdirs*localdirs).sum(axis=1))
+		t = self.geometry.hitarray(_transformarray(self.inverse, origins), localdirs / scales[:,None])
+		return t / scales
+
+	def normalarray(self, points):
+		normals = self.geometry.normalarray(_transformarray(self.inverse, points))
+		normals = _transformarray(self.normaltransform, normals, False)
+		return normals / numpy.sqrt((normals*normals).sum(axis=1))[:,None]
+
+	def colorarray(self, points, footprints=None, dirs=None):
+		#footprints are as much wider in the coordinates of the geometry as distances along the rays in dirs
+		localdirs = None
+		if footprints is not None and dirs is not None:
+			localdirs = _transformarray(self.inverse, dirs, False)
+			footprints = footprints * numpy.sqrt((localdirs*localdirs).sum(axis=1) / (dirs*dirs).sum(axis=1))
+		if isinstance(self.geometry, Instance):
+			return self.geometry.colorarray(_transformarray(self.inverse, points), footprints, localdirs)
+		return self.geometry.colorarray(_transformarray(self.inverse, points), footprints)
+
+class _InstanceHit( object ):
+	#the geometry hit inside an instance, what the instance keeps as lasthit so it can be shaded in scene coordinates
+	__slots__ = ("instance", "obj", "scale")
+
+	def __init__(self, instance, obj, scale):
+		self.instance = instance
+		self.obj = obj
+		#how much longer distances along the ray that hit are in the coordinates of the geometry
+		self.scale = scale
+
+	def normal(self, point):
+		instance = self.instance
+		n = self.obj.normal(instance.inverse.transform(point))
+		return instance.normaltransform.transformdirection(n).normalize_()
+
+	def getcolor(self, point, footprint=None):
+		if footprint is not None:
+			footprint *= self.scale
+		return self.obj.getcolor(self.instance.inverse.transform(point), footprint)
+
+	@property
+	def material(self):
+		return getattr(self.obj, "material", None)
+
+#how near a point must be to a voxel side to be on it, measured in voxel widths
+VOXEL_TOLERANCE = 1e-6
+
+def _voxelside(q, dims, voxel):
+	"""
+	The filled voxel whose side a hitpoint q (in voxel widths from the volume corner) is on, and the
+	axis and direction that side faces. The voxel function gives the palette index of a voxel x,y,z.
+	"""
+	#the voxels the point is inside of or on the border of, more than one on edges and corners
+	lows = [int(math.floor(c-VOXEL_TOLERANCE)) for c in q]
+	highs = [int(math.floor(c+VOXEL_TOLERANCE)) for c in q]
+	for z in xrange(lows[2], highs[2]+1):
+		for y in xrange(lows[1], highs[1]+1):
+			for x in xrange(lows[0], highs[0]+1):
+				cell = [x,y,z]
+				if not voxel(x,y,z):
+					continue
+				#a side the point is on, with an empty voxel on the other side of it
+				for axis in xrange(3):
+					for facing,border in ((-1,cell[axis]), (1,cell[axis]+1)):
+						if abs(q[axis]-border) < VOXEL_TOLERANCE:
+							neighbour = list(cell)
+							neighbour[axis] += facing
+							if not voxel(*neighbour):
+								return cell, axis, facing
+	#not on a filled voxel, should not happen for hitpoints
+	cell = [min(max(int(math.floor(c)), 0), n-1) for c,n in zip(q, dims)]
+	axis = min(xrange(3), key=lambda a: abs(q[a]-round(q[a])))
+	return cell, axis, -1
+
+class VoxelVolume( object ):
+	"""
+	A box of equally sized cubic voxels, each either empty or filled with a color, eg a scanned or
+	generated volume. Takes one byte per voxel, an index into a palette of up to 255 colors, and is
+	filled a shape at a time. A ray steps through it voxel by voxel (3D-DDA) until it enters a filled
+	one, so it can be given to testRay along with the other geometries.
+
+	- origin: a vector of the corner of the volume with the lowest x, y and z
+	- dims: the nr of voxels along the x, y and z sides
+	- *voxelsize: the width of each voxel, measured in the same coordinate system as the vectors
+	- *material: a material instance if the voxels should mirror or let through light
+	"""
+	def __init__(self, origin, dims, voxelsize=1.0, material=None):
+		self.origin = origin
+		self.dims = tuple(int(n) for n in dims)
+		self.voxelsize = float(voxelsize)
+		self.material = material
+		nx,ny,nz = self.dims
+		#the palette index of each voxel, x fastest then y then z, 0 for empty
+		self.voxels = bytearray(nx*ny*nz)
+		self.palette = [None]
+		self.box = (origin.x, origin.y, origin.z,
+			    origin.x+nx*self.voxelsize, origin.y+ny*self.voxelsize, origin.z+nz*self.voxelsize)
+
+	def array(self):
+		"""
+		A (z,y,x) numpy view of the palette index of each voxel, writing to it fills or empties the voxels.
+		"""
+		nx,ny,nz = self.dims
+		return numpy.frombuffer(self.voxels, dtype=numpy.uint8).reshape(nz,ny,nx)
+
+	def colorindex(self, color):
+		"""
+		The palette index of a color, added to the palette if not already there. None is the index of empty voxels.
+
+		- color: a color instance, or None
+		"""
+		if color is None:
+			return 0
+		for index,other in enumerate(self.palette):
+			if other is not None and (other.x,other.y,other.z) == (color.x,color.y,color.z):
+				return index
+		if len(self.palette) > 255:
+			raise ValueError("a voxel volume can have at most 255 colors")
+		self.palette.append(color)
+		return len(self.palette)-1
+
+	def _tovoxels(self, point):
+		o,size = self.origin,self.voxelsize
+		return (point.x-o.x)/size, (point.y-o.y)/size, (point.z-o.z)/size
+
+	def _fillrow(self, y, z, x1, x2, index):
+		#sets the voxels x1 to x2 of a row, clipped to the volume
+		nx = self.dims[0]
+		x1,x2 = max(x1, 0), min(x2, nx-1)
+		if x1 <= x2:
+			start = x1 + nx*(y + self.dims[1]*z)
+			self.voxels[start:start+x2-x1+1] = bytearray((index,)) * (x2-x1+1)
+
+	def fillbox(self, corner1, corner2, color):
+		"""
+		Fills the voxels whose centers are inside a box.
+
+		- corner1: a vector of one corner of the box
+		- corner2: a vector of the opposite corner
+		- color: a color instance, or None to empty the voxels instead
+		"""
+		index = self.colorindex(color)
+		lows,highs = self._tovoxels(corner1),self._tovoxels(corner2)
+		ranges = []
+		for low,high,n in zip(lows, highs, self.dims):
+			low,high = min(low,high),max(low,high)
+			#voxel k has its center at k+0.5
+			ranges.append((max(int(math.ceil(low-0.5)), 0), min(int(math.floor(high-0.5)), n-1)))
+		(x1,x2),(y1,y2),(z1,z2) = ranges
+		for z in xrange(z1, z2+1):
+			for y in xrange(y1, y2+1):
+				self._fillrow(y, z, x1, x2, index)
+
+	def fillsphere(self, center, radius, color, thickness=None):
+		"""
+		Fills the voxels whose centers are inside a ball, or only those near its surface.
+
+		- center: a vector of the center of the sphere
+		- radius: the radius of the sphere
+		- color: a color instance, or None to empty the voxels instead
+		- *thickness: how far inside the surface to fill, leaving the rest of the ball as it was, default is all of it
+		"""
+		index = self.colorindex(color)
+		cx,cy,cz = self._tovoxels(center)
+		r = radius/self.voxelsize
+		inner = (r - thickness/self.voxelsize) if thickness is not None else None
+		nx,ny,nz = self.dims
+		#only rows are looped over, each row is filled in one or two runs
+		for z in xrange(max(int(math.ceil(cz-r-0.5)), 0), min(int(math.floor(cz+r-0.5)), nz-1)+1):
+			dz = z+0.5-cz
+			for y in xrange(max(int(math.ceil(cy-r-0.5)), 0), min(int(math.floor(cy+r-0.5)), ny-1)+1):
+				dy = y+0.5-cy
+				rest = r*r - dy*dy - dz*dz
+				if rest < 0:
+					continue
+				half = sqrt(rest)
+				x1,x2 = int(math.ceil(cx-half-0.5)), int(math.floor(cx+half-0.5))
+				innerrest = inner*inner - dy*dy - dz*dz if inner is not None and inner > 0 else -1
+				if innerrest > 0:
+					#leave out the run through the hollow inside
+					innerhalf = sqrt(innerrest)
+					self._fillrow(y, z, x1, int(math.ceil(cx-innerhalf-0.5))-1, index)
+					self._fillrow(y, z, int(math.floor(cx+innerhalf-0.5))+1, x2, index)
+				else:
+					self._fillrow(y, z, x1, x2, index)
+
+	def fillcheckerboard(self, corner1, corner2, squaresize, color1, color2):
+		"""
+		Fills a box with a checkerboard pattern of two colors, eg as a floor.
+
+		- corner1: a vector of one corner of the box
+		- corner2: a vector of the opposite corner
+		- squaresize: the width of each square, measured in the same coordinate system as the vectors
+		- color1: a color instance of the squares starting at corner1
+		- color2: a color instance of the other squares
+		"""
+		x1,x2 = sorted((corner1.x, corner2.x))
+		y1,y2 = sorted((corner1.y, corner2.y))
+		z1,z2 = sorted((corner1.z, corner2.z))
+		#squares along the two widest sides, the narrowest is the thickness
+		sides = sorted(xrange(3), key=lambda axis: (x1,y1,z1)[axis]-(x2,y2,z2)[axis])[:2]
+		lows,highs = [x1,y1,z1],[x2,y2,z2]
+		counts = [int(math.ceil((highs[axis]-lows[axis])/float(squaresize))) for axis in sides]
+		for i in xrange(counts[0]):
+			for j in xrange(counts[1]):
+				low,high = list(lows),list(highs)
+				for axis,k in zip(sides, (i,j)):
+					low[axis] = lows[axis] + k*squaresize
+					high[axis] = min(low[axis] + squaresize, highs[axis])
+				self.fillbox(_vector(*low), _vector(*high), color1 if (i+j) % 2 == 0 else color2)
+
+	def bbox(self):
+		return self.box
+
+	def hit(self, ray):
+		"""
+		Returns the distance to where the ray enters the first filled voxel beyond EPSILON.
+		"""
+		ox,oy,oz = ray.o.x,ray.o.y,ray.o.z
+		dx,dy,dz = ray.d.x,ray.d.y,ray.d.z
+		ix = 1.0/dx if dx else 1e300
+		iy = 1.0/dy if dy else 1e300
+		iz = 1.0/dz if dz else 1e300
+		box = self.box
+		#where the ray enters and leaves the volume
+		t1 = (box[0]-ox)*ix
+		t2 = (box[3]-ox)*ix
+		if t1 > t2: t1,t2 = t2,t1
+		t3 = (box[1]-oy)*iy
+		t4 = (box[4]-oy)*iy
+		if t3 > t4: t3,t4 = t4,t3
+		if t3 > t1: t1 = t3
+		if t4 < t2: t2 = t4
+		t3 = (box[2]-oz)*iz
+		t4 = (box[5]-oz)*iz
+		if t3 > t4: t3,t4 = t4,t3
+		if t3 > t1: t1 = t3
+		if t4 < t2: t2 = t4
+		if t2 < t1 or t2 < 0:
+			return NOHIT
+		t = max(t1, 0.0)
+		nx,ny,nz = self.dims
+		size = self.voxelsize
+		bx,by,bz = box[0],box[1],box[2]
+		#the starting voxel, and for each side the step direction and which border of the voxel the ray leaves through
+		cells = []
+		for o,d,low,n in ((ox,dx,bx,nx), (oy,dy,by,ny), (oz,dz,bz,nz)):
+			cell = min(max(int((o+d*t-low)/size), 0), n-1)
+			cells.append((cell, 1, 1) if d > 0 else (cell, -1, 0) if d < 0 else (cell, 0, 0))
+		(cx,stepx,edgex),(cy,stepy,edgey),(cz,stepz,edgez) = cells
+		#the distances to the next voxel borders, worked out from the voxel rather than added up
+		#step by step, so that VoxelOctree.hit finds exactly the same ones
+		nextx = (bx+(cx+edgex)*size-ox)*ix if dx else float("inf")
+		nexty = (by+(cy+edgey)*size-oy)*iy if dy else float("inf")
+		nextz = (bz+(cz+edgez)*size-oz)*iz if dz else float("inf")
+		voxels = self.voxels
+		visited = 0
+		while True:
+			visited += 1
+			#voxels entered at or before the ray start are the surface it starts from
+			if voxels[cx + nx*(cy + ny*cz)] and t > EPSILON:
+				break
+			#step into the neighbouring voxel whose border is nearest, on ties the first side like numpy's argmin
+			if nextx <= nexty and nextx <= nextz:
+				t = nextx
+				cx += stepx
+				nextx = (bx+(cx+edgex)*size-ox)*ix
+				inside = 0 <= cx < nx
+			elif nexty <= nextz:
+				t = nexty
+				cy += stepy
+				nexty = (by+(cy+edgey)*size-oy)*iy
+				inside = 0 <= cy < ny
 			else:
-				return Intersection( Vector(0,0,0), -1, Vector(0,0,0), self)
+				t = nextz
+				cz += stepz
+				nextz = (bz+(cz+edgez)*size-oz)*iz
+				inside = 0 <= cz < nz
+			if t > t2 or not inside:
+				t = NOHIT
+				break
+		if _stats is not None: _stats.testnamed("Voxel", visited)
+		return t
+
+	def intersection(self, ray):
+		return _intersection(ray, self.hit(ray), self)
+
+	def voxel(self, x, y, z):
+		"""
+		The palette index of the voxel at x,y,z, 0 if it is empty or outside the volume.
+		"""
+		nx,ny,nz = self.dims
+		if 0 <= x < nx and 0 <= y < ny and 0 <= z < nz:
+			return self.voxels[x + nx*(y + ny*z)]
+		return 0
+
+	def normal(self, point):
+		cell,axis,facing = _voxelside(self._tovoxels(point), self.dims, self.voxel)
+		n = [0.0,0.0,0.0]
+		n[axis] = facing
+		return _vector(*n)
+
+	def getcolor(self, point, footprint=None):
+		cell,axis,facing = _voxelside(self._tovoxels(point), self.dims, self.voxel)
+		return self.palette[self.voxel(*cell)] or _vector(0,0,0)
+
+	def hitarray(self, origins, dirs):
+		#the same traversal as hit, stepping all rays still inside the volume at once
+		count = len(dirs)
+		origins = numpy.broadcast_to(origins, dirs.shape)
+		low,high = numpy.array(self.box[:3]),numpy.array(self.box[3:])
+		dims = numpy.array(self.dims)
+		size = self.voxelsize
+		with numpy.errstate(divide="ignore", invalid="ignore"):
+			inv = 1.0/dirs
+			t1 = (low-origins)*inv
+			t2 = (high-origins)*inv
+		#rays parallel to a side are inside its slab for good or never
+		within = (origins >= low) & (origins <= high)
+		tlow = numpy.where(dirs != 0, numpy.minimum(t1,t2), numpy.where(within, -numpy.inf, numpy.inf))
+		thigh = numpy.where(dirs != 0, numpy.maximum(t1,t2), numpy.where(within, numpy.inf, -numpy.inf))
+		t = numpy.maximum(tlow.max(axis=1), 0.0)
+		texit = thigh.min(axis=1)
+		result = numpy.full(count, numpy.inf)
+		sel = numpy.nonzero(t <= texit)[0]
+		o,d,inv,t,texit = origins[sel],dirs[sel],inv[sel],t[sel],texit[sel]
+		cells = numpy.clip(numpy.floor((o + d*t[:,None] - low)/size), 0, dims-1).astype(numpy.intp)
+		steps = numpy.sign(d).astype(numpy.intp)
+		edges = (d > 0).astype(numpy.intp)
+		with numpy.errstate(invalid="ignore"):
+			nexts = numpy.where(d != 0, (low+(cells+edges)*size-o)*inv, numpy.inf)
+		voxels = numpy.frombuffer(self.voxels, dtype=numpy.uint8)
+		strides = numpy.array([1, dims[0], dims[0]*dims[1]])
+		while len(sel):
+			filled = (voxels[cells.dot(strides)] != 0) & (t > EPSILON)
+			result[sel[filled]] = t[filled]
+			keep = ~filled
+			sel,o,inv,cells,steps,edges,nexts,t,texit = sel[keep],o[keep],inv[keep],cells[keep],steps[keep],edges[keep],nexts[keep],t[keep],texit[keep]
+			rows = numpy.arange(len(sel))
+			axes = nexts.argmin(axis=1)
+			t = nexts[rows,axes]
+			cells[rows,axes] += steps[rows,axes]
+			moved = cells[rows,axes]
+			nexts[rows,axes] = (low[axes]+(moved+edges[rows,axes])*size-o[rows,axes])*inv[rows,axes]
+			keep = (moved >= 0) & (moved < dims[axes]) & (t <= texit)
+			sel,o,inv,cells,steps,edges,nexts,t,texit = sel[keep],o[keep],inv[keep],cells[keep],steps[keep],edges[keep],nexts[keep],t[keep],texit[keep]
+		return result
+
+	def _locatearray(self, points):
+		#the array version of _voxelside
+		count = len(points)
+		dims = numpy.array(self.dims)
+		strides = numpy.array([1, dims[0], dims[0]*dims[1]])
+		voxels = numpy.frombuffer(self.voxels, dtype=numpy.uint8)
+		def filled(cells):
+			inside = ((cells >= 0) & (cells < dims)).all(axis=1)
+			return inside & (voxels[numpy.clip(cells, 0, dims-1).dot(strides)] != 0)
+		q = (points - _vecarray(self.origin)) / self.voxelsize
+		lows = numpy.floor(q-VOXEL_TOLERANCE).astype(numpy.intp)
+		highs = numpy.floor(q+VOXEL_TOLERANCE).astype(numpy.intp)
+		#not on a filled voxel, should not happen for hitpoints
+		indexes = numpy.clip(numpy.floor(q), 0, dims-1).astype(numpy.intp).dot(strides)
+		axes = numpy.abs(q - numpy.round(q)).argmin(axis=1)
+		facings = numpy.full(count, -1.0)
+		found = numpy.zeros(count, dtype=bool)
+		#same order as _voxelside
+		for offset in ((x,y,z) for z in (0,1) for y in (0,1) for x in (0,1)):
+			cells = lows + offset
+			candidates = (cells <= highs).all(axis=1) & filled(cells)
+			for axis in xrange(3):
+				for facing,border in ((-1,cells[:,axis]), (1,cells[:,axis]+1)):
+					neighbours = cells.copy()
+					neighbours[:,axis] += facing
+					use = ~found & candidates & (numpy.abs(q[:,axis]-border) < VOXEL_TOLERANCE) & ~filled(neighbours)
+					indexes[use] = cells[use].dot(strides)
+					axes[use] = axis
+					facings[use] = facing
+					found |= use
+		return indexes,axes,facings
+
+	def normalarray(self, points):
+		indexes,axes,facings = self._locatearray(points)
+		normals = numpy.zeros((len(points),3))
+		normals[numpy.arange(len(points)),axes] = facings
+		return normals
+
+	def colorarray(self, points, footprints=None):
+		indexes,axes,facings = self._locatearray(points)
+		palette = numpy.array([(0,0,0)] + [(color.x,color.y,color.z) for color in self.palette[1:]], dtype=float)
+		return palette[numpy.frombuffer(self.voxels, dtype=numpy.uint8)[indexes]]
+
+#octree entries with this bit set are boxes entirely filled with the palette index in the lower bits
+OCTREE_FILLED = 0x80000000
+
+OCTREE_MAGIC = b"PY3DSVO1"
+
+def _octreenode(nodes, codes, colors, lo, hi, level):
+	"""
+	Adds a node for the filled voxels codes[lo:hi], all inside the same box 2**level voxels wide,
+	and returns its index. Each node is 8 entries in nodes, one per half-width box inside it:
+	0 if empty, OCTREE_FILLED plus a palette index if filled, otherwise the index of its node.
+	"""
+	node = len(nodes)//8
+	nodes.extend((0,0,0,0,0,0,0,0))
+	shift = 3*(level-1)
+	prefix = codes[lo] >> (3*level) << (3*level) if lo < hi else 0
+	start = lo
+	for child in xrange(8):
+		end = bisect.bisect_left(codes, prefix + ((child+1) << shift), start, hi)
+		if end > start:
+			#boxes filled with a single color need no nodes below them
+			if end-start == 1 << shift and min(colors[start:end]) == max(colors[start:end]):
+				nodes[8*node+child] = OCTREE_FILLED | colors[start]
+			else:
+				nodes[8*node+child] = _octreenode(nodes, codes, colors, start, end, level-1)
+		start = end
+	return node
+
+def _octreecell(o, d, i, low, size, t, cell, first, last, crossed):
+	"""
+	The voxel along one side of a ray at distance t, between voxel first and last. Corrects the guess
+	cell by comparing t to the distances to its borders, so that rays through the edges and corners of
+	voxels go from voxel to neighbouring voxel. Borders at exactly t count as crossed if crossed is true.
+	"""
+	if d > 0:
+		while cell < last and ((low+(cell+1)*size-o)*i < t or crossed and (low+(cell+1)*size-o)*i == t):
+			cell += 1
+		while cell > first and ((low+cell*size-o)*i > t or not crossed and (low+cell*size-o)*i == t):
+			cell -= 1
+	elif d < 0:
+		while cell > first and ((low+cell*size-o)*i < t or crossed and (low+cell*size-o)*i == t):
+			cell -= 1
+		while cell < last and ((low+(cell+1)*size-o)*i > t or not crossed and (low+(cell+1)*size-o)*i == t):
+			cell += 1
+	return min(max(cell, first), last)
+
+class VoxelOctree( object ):
+	"""
+	A sparse version of a VoxelVolume, storing nodes only for boxes of voxels that are partly filled,
+	so its memory grows with the filled voxels rather than the size of the volume. A ray skips each
+	empty or entirely filled box in a single step, which for mostly empty volumes takes far fewer
+	steps than going voxel by voxel. Create it with VoxelOctree.fromvolume, and save and load it with
+	save and VoxelOctree.load. Only supported by the python backend.
+
+	- origin: a vector of the corner of the volume with the lowest x, y and z
+	- dims: the nr of voxels along the x, y and z sides
+	- voxelsize: the width of each voxel, measured in the same coordinate system as the vectors
+	- palette: a list of the color instances of each palette index, starting with None for empty voxels
+	- nodes: the flat sequence of 8 unsigned 32 bit entries per node, starting with the root node
+	- *material: a material instance if the voxels should mirror or let through light, not kept by save
+	"""
+	def __init__(self, origin, dims, voxelsize, palette, nodes, material=None):
+		self.origin = origin
+		self.dims = tuple(int(n) for n in dims)
+		self.voxelsize = float(voxelsize)
+		self.material = material
+		self.palette = list(palette)
+		self.nodes = nodes
+		self.filepath = None
+		#the root node is a cube 2**depth voxels wide
+		self.depth = 1
+		while (1 << self.depth) < max(self.dims):
+			self.depth += 1
+		nx,ny,nz = self.dims
+		self.box = (origin.x, origin.y, origin.z,
+			    origin.x+nx*self.voxelsize, origin.y+ny*self.voxelsize, origin.z+nz*self.voxelsize)
+
+	@classmethod
+	def fromvolume(cls, volume):
+		"""
+		Creates an octree of the filled voxels of a voxel volume.
+
+		- volume: a VoxelVolume instance
+		"""
+		nx,ny,nz = volume.dims
+		depth = 1
+		while (1 << depth) < max(volume.dims):
+			depth += 1
+		#the bits of x, y and z interleaved, so that the voxels of each box are sorted together
+		spread = [0] * (1 << depth)
+		for value in xrange(1 << depth):
+			for bit in xrange(depth):
+				spread[value] |= ((value >> bit) & 1) << (3*bit)
+		filled = []
+		voxels = volume.voxels
+		for z in xrange(nz):
+			for y in xrange(ny):
+				start = nx*(y + ny*z)
+				row = voxels[start:start+nx]
+				if row.count(0) == nx:
+					continue
+				code = (spread[y] << 1) | (spread[z] << 2)
+				for x,index in enumerate(row):
+					if index:
+						filled.append((spread[x] | code, index))
+		filled.sort()
+		codes = [code for code,index in filled]
+		colors = [index for code,index in filled]
+		nodes = array("I")
+		_octreenode(nodes, codes, colors, 0, len(codes), depth)
+		return cls(volume.origin, volume.dims, volume.voxelsize, volume.palette, nodes, volume.material)
+
+	def save(self, filepath):
+		"""
+		Saves the octree to a file, which VoxelOctree.load can read back or map into memory.
+
+		- filepath: the path of the file to write
+		"""
+		o = self.origin
+		colors = [(color.x,color.y,color.z) for color in self.palette[1:]]
+		with open(filepath, "wb") as writer:
+			writer.write(struct.pack("<8s4d4I", OCTREE_MAGIC, o.x, o.y, o.z, self.voxelsize,
+						 self.dims[0], self.dims[1], self.dims[2], len(colors)))
+			for color in colors:
+				writer.write(struct.pack("<3d", *color))
+			nodes = array("I", self.nodes)
+			#always little endian
+			if sys.byteorder == "big":
+				nodes.byteswap()
+			nodes.tofile(writer)
+
+	@classmethod
+	def load(cls, filepath, mapped=True):
+		"""
+		Loads an octree saved with save.
+
+		- filepath: the path of the file to read
+		- *mapped: whether to map the nodes into memory instead of reading them, so only the parts that rays pass through are read from disk
+		"""
+		with open(filepath, "rb") as reader:
+			header = reader.read(struct.calcsize("<8s4d4I"))
+			magic,x,y,z,voxelsize,nx,ny,nz,count = struct.unpack("<8s4d4I", header)
+			if magic != OCTREE_MAGIC:
+				raise ValueError("%s is not a saved voxel octree" % filepath)
+			palette = [None] + [Color(*struct.unpack("<3d", reader.read(24))) for _ in xrange(count)]
+			offset = reader.tell()
+			#memory views can only be read as unsigned ints in python 3
+			if mapped and hasattr(memoryview, "cast") and sys.byteorder == "little":
+				mapping = mmap.mmap(reader.fileno(), 0, access=mmap.ACCESS_READ)
+				nodes = memoryview(mapping)[offset:].cast("I")
+			else:
+				mapped = False
+				nodes = array("I")
+				if PYTHON3:
+					nodes.frombytes(reader.read())
+				else:
+					nodes.fromstring(reader.read())
+				if sys.byteorder == "big":
+					nodes.byteswap()
+		octree = cls(Vector(x,y,z), (nx,ny,nz), voxelsize, palette, nodes)
+		if mapped:
+			octree.filepath = filepath
+		return octree
+
+	def __getstate__(self):
+		#memory maps cannot be sent to worker processes, they map the file again instead
+		state = dict(self.__dict__)
+		if self.filepath is not None:
+			state["nodes"] = None
+		return state
+
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		if self.filepath is not None:
+			self.nodes = VoxelOctree.load(self.filepath).nodes
+
+	def __len__(self):
+		"The nr of nodes."
+		return len(self.nodes)//8
+
+	def voxel(self, x, y, z):
+		"""
+		The palette index of the voxel at x,y,z, 0 if it is empty or outside the volume.
+		"""
+		nx,ny,nz = self.dims
+		if not (0 <= x < nx and 0 <= y < ny and 0 <= z < nz):
+			return 0
+		nodes = self.nodes
+		node = 0
+		half = 1 << (self.depth-1)
+		while True:
+			entry = nodes[8*node + (1 if x & half else 0) + (2 if y & half else 0) + (4 if z & half else 0)]
+			if entry == 0 or entry & OCTREE_FILLED:
+				return entry & 0xFF
+			node = entry
+			half >>= 1
+
+	def _tovoxels(self, point):
+		o,size = self.origin,self.voxelsize
+		return (point.x-o.x)/size, (point.y-o.y)/size, (point.z-o.z)/size
+
+	def bbox(self):
+		return self.box
+
+	def hit(self, ray):
+		"""
+		Returns the distance to where the ray enters the first filled voxel beyond EPSILON.
+		"""
+		ox,oy,oz = ray.o.x,ray.o.y,ray.o.z
+		dx,dy,dz = ray.d.x,ray.d.y,ray.d.z
+		ix = 1.0/dx if dx else 1e300
+		iy = 1.0/dy if dy else 1e300
+		iz = 1.0/dz if dz else 1e300
+		box = self.box
+		#where the ray enters and leaves the volume
+		t1 = (box[0]-ox)*ix
+		t2 = (box[3]-ox)*ix
+		if t1 > t2: t1,t2 = t2,t1
+		t3 = (box[1]-oy)*iy
+		t4 = (box[4]-oy)*iy
+		if t3 > t4: t3,t4 = t4,t3
+		if t3 > t1: t1 = t3
+		if t4 < t2: t2 = t4
+		t3 = (box[2]-oz)*iz
+		t4 = (box[5]-oz)*iz
+		if t3 > t4: t3,t4 = t4,t3
+		if t3 > t1: t1 = t3
+		if t4 < t2: t2 = t4
+		if t2 < t1 or t2 < 0:
+			return NOHIT
+		t = max(t1, 0.0)
+		nx,ny,nz = self.dims
+		size = self.voxelsize
+		bx,by,bz = box[0],box[1],box[2]
+		#the voxel the ray is in
+		x = min(max(int((ox+dx*t-bx)/size), 0), nx-1)
+		y = min(max(int((oy+dy*t-by)/size), 0), ny-1)
+		z = min(max(int((oz+dz*t-bz)/size), 0), nz-1)
+		nodes = self.nodes
+		depth = self.depth
+		top = 1 << (depth-1)
+		#the nodes from the root down to the voxel, the boxes of path[k] are top >> k wide
+		path = [0]
+		steps = 0
+		while True:
+			steps += 1
+			#the largest empty or filled box that the voxel is in
+			node = path[-1]
+			half = top >> (len(path)-1)
+			while True:
+				entry = nodes[8*node + (1 if x & half else 0) + (2 if y & half else 0) + (4 if z & half else 0)]
+				if entry == 0 or entry & OCTREE_FILLED:
+					break
+				node = entry
+				path.append(node)
+				half >>= 1
+			#boxes entered at or before the ray start are the surface it starts from
+			if entry and t > EPSILON:
+				break
+			if entry:
+				#the ray starts inside the filled box, so goes on voxel by voxel like VoxelVolume.hit
+				#until it enters one beyond EPSILON
+				half = 1
+			px,py,pz = x,y,z
+			#leave the box, which is half wide, through the side the ray reaches first
+			lx,ly,lz = x & -half, y & -half, z & -half
+			tx = (bx+(lx+half)*size-ox)*ix if dx > 0 else (bx+lx*size-ox)*ix if dx < 0 else float("inf")
+			ty = (by+(ly+half)*size-oy)*iy if dy > 0 else (by+ly*size-oy)*iy if dy < 0 else float("inf")
+			tz = (bz+(lz+half)*size-oz)*iz if dz > 0 else (bz+lz*size-oz)*iz if dz < 0 else float("inf")
+			#the voxel entered on the other sides, which on ties have already been crossed if they come first like in VoxelVolume.hit
+			if tx <= ty and tx <= tz:
+				t = tx
+				x = lx+half if dx > 0 else lx-1
+				inside = 0 <= x < nx
+				y = _octreecell(oy, dy, iy, by, size, t, int((oy+dy*t-by)/size), ly, ly+half-1, False)
+				z = _octreecell(oz, dz, iz, bz, size, t, int((oz+dz*t-bz)/size), lz, lz+half-1, False)
+			elif ty <= tz:
+				t = ty
+				y = ly+half if dy > 0 else ly-1
+				inside = 0 <= y < ny
+				x = _octreecell(ox, dx, ix, bx, size, t, int((ox+dx*t-bx)/size), lx, lx+half-1, True)
+				z = _octreecell(oz, dz, iz, bz, size, t, int((oz+dz*t-bz)/size), lz, lz+half-1, False)
+			else:
+				t = tz
+				z = lz+half if dz > 0 else lz-1
+				inside = 0 <= z < nz
+				x = _octreecell(ox, dx, ix, bx, size, t, int((ox+dx*t-bx)/size), lx, lx+half-1, True)
+				y = _octreecell(oy, dy, iy, by, size, t, int((oy+dy*t-by)/size), ly, ly+half-1, True)
+			if t > t2 or not inside:
+				t = NOHIT
+				break
+			#back up to the smallest node around both the old and the new voxel
+			del path[depth - ((x^px) | (y^py) | (z^pz)).bit_length() + 1:]
+		if _stats is not None: _stats.testnamed("Voxel", steps)
+		return t
+
+	def intersection(self, ray):
+		return _intersection(ray, self.hit(ray), self)
+
+	def normal(self, point):
+		cell,axis,facing = _voxelside(self._tovoxels(point), self.dims, self.voxel)
+		n = [0.0,0.0,0.0]
+		n[axis] = facing
+		return _vector(*n)
+
+	def getcolor(self, point, footprint=None):
+		cell,axis,facing = _voxelside(self._tovoxels(point), self.dims, self.voxel)
+		return self.palette[self.voxel(*cell)] or _vector(0,0,0)
 
 ##class Box( object ):
 ##        "not done. consists of multiple rectangle objects as its sides"
@@ -304,17 +1723,90 @@ class AnimatedObject( object ):
         def __getitem__(self, index):
                 return self.objs[index]
 
+        def __len__(self):
+                return len(self.objs)
+
         def reverse(self):
                 self.objs = [each for each in reversed(self.objs)]
                 return self
 
 
+#RENDER STATISTICS
+class RenderStats( object ):
+	"""
+	Counts of the work done during a render, and the time taken by each phase of it.
+	Returned by renderScene when it is given stats=True.
+
+	- primaryrays: the nr of rays sent from the camera
+	- shadowrays: the nr of rays sent towards the lights
+	- maxdepth: the deepest level of rays traced from other rays, 0 if only camera and shadow rays
+	- tests: the nr of ray intersection tests per geometry type name
+	- testcount: the total nr of ray intersection tests
+	- texturelookups: the nr of texture colors sampled
+	- phases: the seconds spent on each phase of the render (setup, trace, encode into the image file format, save the file)
+	- pixelcosts: when rendered with a heatmap, the nr of intersection tests made for each pixel, row by row from the top
+	"""
+	def __init__(self):
+		self.primaryrays = 0
+		self.shadowrays = 0
+		self.maxdepth = 0
+		self.tests = dict()
+		self.testcount = 0
+		self.texturelookups = 0
+		self.phases = dict()
+		self.pixelcosts = None
+
+	def test(self, obj, count=1):
+		#acceleration structures and meshes count the geometries they test instead
+		if not hasattr(obj, "intersect"):
+			self.testnamed(type(obj).__name__, count)
+
+	def testnamed(self, name, count=1):
+		self.tests[name] = self.tests.get(name, 0) + count
+		self.testcount += count
+
+	def addtime(self, phase, seconds):
+		self.phases[phase] = self.phases.get(phase, 0) + seconds
+
+	def merge(self, other):
+		"""
+		Adds the counts of another stats instance to these, eg those collected by a worker process.
+		"""
+		self.primaryrays += other.primaryrays
+		self.shadowrays += other.shadowrays
+		self.maxdepth = max(self.maxdepth, other.maxdepth)
+		for name,count in other.tests.items():
+			self.tests[name] = self.tests.get(name, 0) + count
+		self.testcount += other.testcount
+		self.texturelookups += other.texturelookups
+		for phase,seconds in other.phases.items():
+			self.addtime(phase, seconds)
+
+	def report(self):
+		"""
+		The statistics as readable lines of text.
+		"""
+		lines = ["primary rays: %s" % self.primaryrays,
+			 "shadow rays: %s" % self.shadowrays,
+			 "max recursion depth: %s" % self.maxdepth,
+			 "texture lookups: %s" % self.texturelookups]
+		for name,count in sorted(self.tests.items()):
+			lines.append("%s intersection tests: %s" % (name, count))
+		for phase,seconds in sorted(self.phases.items()):
+			lines.append("%s time: %.3f seconds" % (phase, seconds))
+		return "\n".join(lines)
+
+#the stats being collected by the current render, None when not asked for so the counting is skipped
+_stats = None
+
+
 #RAY TRACING INTERNAL COMPONENTS
 class Ray( object ):
-	
-	def __init__(self, origin, direction):
+	#spread is the angle that the ray widens by per distance travelled, for camera rays the pixel size
+	def __init__(self, origin, direction, spread=None):
 		self.o = origin
 		self.d = direction
+		self.spread = spread
 		
 class Intersection( object ):
 	#keeps a record of a known intersection bw ray and obj?
@@ -323,59 +1815,1441 @@ class Intersection( object ):
 		self.d = distance
 		self.n = normal
 		self.obj = obj
+
+#what geometry hit methods return when the ray misses, only the distance of a hit is computed up front
+NOHIT = -1
+#shared record returned by testRay when a ray hits nothing, must not be changed
+NOINTERSECTION = Intersection( Vector(0,0,0), NOHIT, Vector(0,0,0), None)
+#hits closer than this are treated as the ray hitting the surface it starts from
+EPSILON = 1e-6
+NAN = float("nan")
+
+def _intersection(ray, distance, obj):
+	"""
+	Creates the full intersection record, with hitpoint and normal, from a hit distance returned by obj.hit.
+	"""
+	if distance == NOHIT:
+		return Intersection( Vector(0,0,0), NOHIT, Vector(0,0,0), obj)
+	o,d = ray.o,ray.d
+	point = _vector(o.x+d.x*distance, o.y+d.y*distance, o.z+d.z*distance)
+	return Intersection(point, distance, obj.normal(point), obj)
 		
 def testRay(ray, objects, ignore=None):
-	intersect = Intersection( Vector(0,0,0), -1, Vector(0,0,0), None)
-	
+	if hasattr(objects, "intersect"):
+		#an acceleration structure, let it do the searching
+		return objects.intersect(ray, ignore)
+	best = NOHIT
+	bestobj = None
+	stats = _stats
 	for obj in objects:
 		if obj is not ignore:
-			currentIntersect = obj.intersection(ray)
-			if currentIntersect.d > 0 and intersect.d < 0:
-				intersect = currentIntersect
-			elif 0 < currentIntersect.d < intersect.d:
-				intersect = currentIntersect
-	return intersect
+			if stats is not None: stats.test(obj)
+			d = obj.hit(ray)
+			if d > 0 and (d < best or best < 0):
+				best = d
+				#groups of geometries (eg a BVH) keep the one they hit as lasthit
+				bestobj = getattr(obj, "lasthit", obj)
+	#only the closest hit gets a full record
+	if bestobj is None:
+		return NOINTERSECTION
+	return _intersection(ray, best, bestobj)
 	
+def occluded(ray, tmax, objects, ignore=None):
+	"""
+	Whether anything blocks the ray before it has travelled the distance tmax, eg a
+	shadow ray towards a light. Unlike testRay it stops at the first blocking hit it finds.
+	Hits closer than EPSILON are ignored, as these are the surface the ray starts from.
+	"""
+	if hasattr(objects, "occluded"):
+		#an acceleration structure, let it do the searching
+		return objects.occluded(ray, tmax, ignore)
+	stats = _stats
+	for obj in objects:
+		if obj is not ignore:
+			if stats is not None: stats.test(obj)
+			if _blocks(obj, ray, tmax):
+				return True
+	return False
+
+def _blocks(obj, ray, tmax):
+	#whether a geometry blocks the ray before tmax, where meshes, hierarchies and instances stop at the first blocking hit they find
+	if hasattr(obj, "occluded"):
+		return obj.occluded(ray, tmax)
+	return EPSILON < obj.hit(ray) < tmax
+
 def trace(ray, objects, light, maxRecur):
 	if maxRecur < 0:
 		return Color(0,0,0) # originally just a tuple, I made it a vector
 	intersect = testRay(ray, objects)
-	#hits nothing
-	if intersect.d == -1:
-		col = Color(AMBIENT,AMBIENT,AMBIENT)
-	#camera sees shadow part of object (not hit by light)
-	elif intersect.n.dot(light - intersect.p) < 0:
-		col = intersect.obj.getcolor(intersect.p) * AMBIENT
-	#camera sees obj in light
+	return _shade(ray, intersect, objects, _lights(light), maxRecur)
+
+def _lights(light):
+	#a single lightsource or a list of them, as a list
+	if isinstance(light, LightSource):
+		return [light]
+	return list(light)
+
+def _shade(ray, intersect, objects, lights, maxRecur):
+	"""
+	The rest of trace, once it is known what the ray hits. Where it hits a reflective or transparent
+	surface the mirrored and let through rays are followed too, in a loop rather than by recursion,
+	each carrying the fraction of the pixel color that it adds (its throughput). These are followed
+	for at most maxRecur bounces, and those adding less than ROULETTE_THROUGHPUT only at random
+	(russian roulette), so faint paths are cut short without darkening the image on average.
+	"""
+	stats = _stats
+	col = _vector(0,0,0)
+	#the rays still to follow, with their throughput and how many bounces they are from the first
+	pending = []
+	throughput = 1.0
+	depth = 0
+	while True:
+		if stats is not None and depth > stats.maxdepth:
+			stats.maxdepth = depth
+		#hits nothing
+		if intersect.d == NOHIT:
+			col.iadd(_vector(AMBIENT,AMBIENT,AMBIENT).imul(throughput))
+		else:
+			own = throughput
+			material = getattr(intersect.obj, "material", None)
+			if material is not None and depth < maxRecur:
+				own *= 1 - material.reflectivity - material.transparency
+				for newray,fraction in _bounce(ray, intersect, material):
+					weight = throughput*fraction
+					if weight < ROULETTE_THROUGHPUT:
+						if _RANDOM.random()*ROULETTE_THROUGHPUT >= weight:
+							continue
+						#the survivors make up for the others
+						weight = ROULETTE_THROUGHPUT
+					pending.append((newray, weight, depth+1))
+			if own > 0:
+				col.iadd(_directlight(ray, intersect, objects, lights).imul(own))
+		if not pending:
+			return col
+		ray,throughput,depth = pending.pop()
+		intersect = testRay(ray, objects)
+
+#decides which faint rays are followed and which lights are sampled, reseeded for each tile so that renders are repeatable
+_RANDOM = random.Random(0)
+
+def _directlight(ray, intersect, objects, lights):
+	"""
+	The color of a hit surface lit by the lights. Lights too far away to make the surface brighter
+	than LIGHT_CUTOFF get no shadow ray, as their brightness only falls off with the distance. If more
+	than LIGHT_SAMPLES lights are left, only that many of them are sampled (see _samplelights). Area
+	lights are shaded with several shadow rays (see _arealight).
+	"""
+	p,n = intersect.p,intersect.n
+	footprint = None
+	if ray.spread is not None:
+		#the width of surface seen by the ray, wider where it hits at a glancing angle
+		d = ray.d
+		cosine = abs(n.x*d.x + n.y*d.y + n.z*d.z) / n.magnitude()
+		footprint = ray.spread * intersect.d / max(cosine, 0.1)
+	nmag = n.magnitude()
+	#the lights on the side of the object that the camera sees, and near enough to matter
+	near = []
+	for light in lights:
+		tolight = _vector(light.x-p.x, light.y-p.y, light.z-p.z)
+		if n.dot(tolight) <= -light.size*nmag:
+			continue
+		lightdist = tolight.magnitude()
+		#the most that the nearest part of the light can light up the surface
+		lightIntensity = light.strength/(4*pi*max(lightdist-light.size, EPSILON)**2)
+		if lightIntensity < LIGHT_CUTOFF:
+			continue
+		near.append((light, tolight, lightdist, lightIntensity, 1.0))
+	if len(near) > LIGHT_SAMPLES:
+		near = _samplelights(near, n, nmag)
+	brightness = 0.0
+	for light,tolight,lightdist,lightIntensity,weight in near:
+		if light.size:
+			brightness += weight*_arealight(p, n, nmag, light, objects)
+			continue
+		lightRay = Ray(p, tolight.normalize_())
+		if _stats is not None: _stats.shadowrays += 1
+		if not occluded(lightRay, lightdist, objects):
+			brightness += weight*(n.x/nmag*(tolight.x*lightIntensity) + n.y/nmag*(tolight.y*lightIntensity) + n.z/nmag*(tolight.z*lightIntensity))
+	return intersect.obj.getcolor(p, footprint) * max(brightness, AMBIENT)
+
+def _samplelights(near, n, nmag):
+	"""
+	Picks LIGHT_SAMPLES of the (light, tolight, distance, intensity, weight) lights near a surface point
+	at random, each in proportion to how much it could light the surface (its intensity there times the
+	cosine of its angle to the normal), so the shading cost stays the same however many lights there
+	are. The weights make up for the lights not picked, so the image is as bright on average. Lights
+	picked more than once are returned once, with their weights added up.
+	"""
+	cumulative = []
+	total = 0.0
+	for light,tolight,lightdist,lightIntensity,weight in near:
+		#area lights may light the surface at a steeper angle than from their position
+		total += lightIntensity * min((n.dot(tolight)/nmag + light.size) / lightdist, 1.0)
+		cumulative.append(total)
+	picked = dict()
+	for _ in xrange(LIGHT_SAMPLES):
+		i = min(bisect.bisect_right(cumulative, _RANDOM.random()*total), len(near)-1)
+		picked[i] = picked.get(i, 0) + 1
+	sampled = []
+	for i,count in sorted(picked.items()):
+		light,tolight,lightdist,lightIntensity,weight = near[i]
+		estimate = cumulative[i] - cumulative[i-1] if i else cumulative[0]
+		sampled.append((light, tolight, lightdist, lightIntensity, count*total/(estimate*LIGHT_SAMPLES)))
+	return sampled
+
+def _arealight(p, n, nmag, light, objects):
+	"""
+	How much an area light lights up a surface point, from shadow rays towards points spread over the
+	light in a grid, each at random within its own cell of the grid (stratified). Starts with a grid of
+	SHADOW_SAMPLES by SHADOW_SAMPLES points, and only where some of these are blocked and others not,
+	ie in the penumbra of a soft shadow, adds a finer grid of PENUMBRA_SAMPLES by PENUMBRA_SAMPLES. So
+	fully lit and fully shadowed surfaces need just a few shadow rays.
+	"""
+	total = 0.0
+	taken = 0
+	for side in (SHADOW_SAMPLES, PENUMBRA_SAMPLES):
+		lit = blocked = 0
+		for qx,qy,qz in light.samplepoints(p, side, _RANDOM):
+			tolight = _vector(qx-p.x, qy-p.y, qz-p.z)
+			cosine = n.dot(tolight)
+			if cosine <= 0:
+				continue
+			lightdist = tolight.magnitude()
+			if _stats is not None: _stats.shadowrays += 1
+			if occluded(Ray(p, tolight.normalize_()), lightdist, objects):
+				blocked += 1
+			else:
+				lit += 1
+				total += cosine / (nmag*lightdist**3)
+		taken += side*side
+		if not (lit and blocked):
+			break
+	return light.strength/(4*pi) * total/taken
+
+def _perpendiculars(x, y, z):
+	#two unit vectors at right angles to each other and to the unit vector x,y,z
+	if abs(x) < 0.9:
+		ax,ay,az = 1.0,0.0,0.0
 	else:
-                #then main
-		lightRay = Ray(intersect.p, (light-intersect.p).normal())
-		if testRay(lightRay, objects, intersect.obj).d == -1:
-			lightIntensity = 1000.0/(4*pi*(light-intersect.p).magnitude()**2)
-			col = intersect.obj.getcolor(intersect.p) * max(intersect.n.normal().dot((light - intersect.p).normal()*lightIntensity), AMBIENT)
-			
-			#TRY REFLECT ONCE (see https://www.cs.unc.edu/~rademach/xroads-RT/RTarticle.html )
-			#working but makes weird result...maybe missing the minus sign somehere...
-##			def vectdot(v1,v2):
-##				return Vector(v1.x*v2.x,v2.y*v1.y,v2.z*v1.z)
-##			#def raymulti(ray,vect):
-##			#	neworig = vectdot(ray.o,vect) *-1
-##			#	newdest = vectdot(ray.d,vect)
-##			#	return Ray(neworig,newdest)
-##			dotprodnr = ray.d.dot(intersect.n) #raymulti(ray,intersect.n)
-##			dotprodray = Vector(dotprodnr,dotprodnr,dotprodnr)
-##			reflectdest = ray.d + (vectdot(vectdot(Vector(2.0,2.0,2.0),intersect.n),dotprodray)) #ray + (vectdot(intersect.n,Vector(2,2,2)))# * dotprodray )
-##			reflect = Ray(intersect.p,reflectdest)
-##			col = trace(reflect,objects,light,maxRecur-1)
-##			#col = Vector(*gammaCorrection(col,AMBIENT))
+		ax,ay,az = 0.0,1.0,0.0
+	ux,uy,uz = ay*z-az*y, az*x-ax*z, ax*y-ay*x
+	mag = sqrt(ux*ux + uy*uy + uz*uz)
+	ux,uy,uz = ux/mag, uy/mag, uz/mag
+	return (ux,uy,uz), (y*uz-z*uy, z*ux-x*uz, x*uy-y*ux)
+
+def _bounce(ray, intersect, material):
+	"""
+	The rays that continue from where a ray hits a reflective or transparent surface, each with
+	the fraction of the color that it adds. They start just off the surface, on the side they leave it.
+	"""
+	d,p = ray.d,intersect.p
+	n = _vector(intersect.n.x, intersect.n.y, intersect.n.z).normalize_()
+	cosine = -(d.x*n.x + d.y*n.y + d.z*n.z)
+	ratio = 1.0/material.refraction
+	if cosine < 0:
+		#leaving the inside of the geometry
+		n.imul(-1)
+		cosine = -cosine
+		ratio = material.refraction
+	rays = []
+	reflectivity = material.reflectivity
+	if material.transparency:
+		k = 1 - ratio*ratio*(1 - cosine*cosine)
+		if k < 0:
+			#too glancing to leave, so all of it is reflected inside
+			reflectivity += material.transparency
 		else:
-			col = intersect.obj.getcolor(intersect.p) * AMBIENT
-	return col
-	
+			m = ratio*cosine - sqrt(k)
+			origin = _vector(p.x-n.x*EPSILON, p.y-n.y*EPSILON, p.z-n.z*EPSILON)
+			rays.append((Ray(origin, _vector(d.x*ratio+n.x*m, d.y*ratio+n.y*m, d.z*ratio+n.z*m)), material.transparency))
+	if reflectivity:
+		m = 2*cosine
+		origin = _vector(p.x+n.x*EPSILON, p.y+n.y*EPSILON, p.z+n.z*EPSILON)
+		rays.append((Ray(origin, _vector(d.x+n.x*m, d.y+n.y*m, d.z+n.z*m)), reflectivity))
+	return rays
+
+def _mirrors(objs):
+	"""
+	Whether any of the geometries, or of those grouped in them, reflect or let through light.
+	"""
+	for obj in objs:
+		material = getattr(obj, "material", None)
+		if material is not None and (material.reflectivity or material.transparency):
+			return True
+		#the geometries of acceleration structures, and the geometry placed by an instance
+		if _mirrors(getattr(obj, "objects", [])):
+			return True
+		if isinstance(obj, Instance) and _mirrors([obj.geometry]):
+			return True
+	return False
+
+#gamma tables look up linear intensities in steps of 1/GAMMA_STEPS
+GAMMA_STEPS = 256
+_GAMMATABLES = dict()
+
+def _gammatable(factor):
+	"""
+	The output byte for each quantized linear intensity from 0 to 255, built once per gamma factor.
+	"""
+	table = _GAMMATABLES.get(factor)
+	if table is None:
+		steps = 255*GAMMA_STEPS
+		table = bytearray(int(pow(i/float(steps),factor)*255) for i in xrange(steps+1))
+		_GAMMATABLES[factor] = table
+	return table
+
+def _gammabytes(values, factor):
+	"""
+	Gamma corrects a sequence of linear intensities into a bytearray, clamping them to 0-255.
+	"""
+	table = _gammatable(factor)
+	return bytearray([table[int(v*GAMMA_STEPS)] if 0 < v < 255 else (255 if v > 0 else 0) for v in values])
+
 def gammaCorrection(color,factor):
-	return (int(pow(color.x/255.0,factor)*255),
-			int(pow(color.y/255.0,factor)*255),
-			int(pow(color.z/255.0,factor)*255))
+	return tuple(_gammabytes((color.x,color.y,color.z), factor))
+
+
+#ACCELERATION STRUCTURES
+def _buildBVH(boxes, count, leafsize):
+	"""
+	Builds a flat bounding volume hierarchy over count boxes, given as a flat
+	array of xmin,ymin,zmin,xmax,ymax,zmax values. Splits each node at the median
+	centroid along its longest axis. Returns the node bounds, the node firsts
+	(child or item index), the node sizes (nr of items, 0 for inner nodes), the
+	node split axes, and the item order that leaves index into.
+	"""
+	order = list(xrange(count))
+	bounds = array("d")
+	firsts = array("i")
+	sizes = array("i")
+	axes = array("b")
+	def newnode():
+		bounds.extend((0.0,0.0,0.0,0.0,0.0,0.0))
+		firsts.append(0)
+		sizes.append(0)
+		axes.append(0)
+		return len(firsts)-1
+	#per axis lookups of the box sides and centroids (times 2), so nodes can be measured with min/max over map
+	lows = [boxes[axis::6] for axis in xrange(3)]
+	highs = [boxes[axis+3::6] for axis in xrange(3)]
+	centroids = [array("d", [low+high for low,high in zip(lows[axis],highs[axis])]) for axis in xrange(3)]
+	stack = [(newnode(), 0, count)]
+	while stack:
+		node, start, end = stack.pop()
+		sub = order[start:end]
+		if not sub:
+			inf = float("inf")
+			bounds[6*node:6*node+6] = array("d", (inf,inf,inf,-inf,-inf,-inf))
+			continue
+		box = [min(map(lows[axis].__getitem__, sub)) for axis in xrange(3)] + [max(map(highs[axis].__getitem__, sub)) for axis in xrange(3)]
+		bounds[6*node:6*node+6] = array("d", box)
+		extents = [max(map(centroids[axis].__getitem__, sub)) - min(map(centroids[axis].__getitem__, sub)) for axis in xrange(3)]
+		axis = extents.index(max(extents))
+		if end-start <= leafsize or extents[axis] <= 0:
+			#few enough items, or all at the same spot so cannot be split
+			firsts[node] = start
+			sizes[node] = end-start
+			continue
+		sub.sort(key=centroids[axis].__getitem__)
+		order[start:end] = sub
+		mid = (start+end)//2
+		left = newnode()
+		right = newnode()
+		firsts[node] = left
+		axes[node] = axis
+		stack.append((left, start, mid))
+		stack.append((right, mid, end))
+	return bounds, firsts, sizes, axes, order
+
+def _boxarea(bounds, node):
+	#the surface area of a node's box
+	b = 6*node
+	dx,dy,dz = bounds[b+3]-bounds[b], bounds[b+4]-bounds[b+1], bounds[b+5]-bounds[b+2]
+	return 2*(dx*dy + dy*dz + dz*dx)
+
+#a refitted hierarchy is rebuilt when its cost has grown by more than this factor since it was built
+REFIT_LIMIT = 1.5
+
+class BVH( object ):
+	"""
+	A bounding volume hierarchy, which groups nearby geometries into nested boxes
+	so that a ray can skip whole groups it does not pass through. Built once from a
+	list of geometries and can then be given to testRay or trace in place of that list.
+	When geometries move or are replaced, eg by the next frame of an animated object,
+	it can be refitted around them instead of rebuilt.
+	Infinite geometries (ie planes) have no bounds and are kept outside the tree.
+
+	- objects: a list of geometry object instances
+	- *leafsize: the max nr of geometries in each of the outermost boxes
+	"""
+	def __init__(self, objects, leafsize=4):
+		self.objects = list(objects)
+		self.leafsize = leafsize
+		self.build()
+
+	def build(self):
+		self.unbounded = []
+		bounded = []
+		boxes = array("d")
+		#the position of each geometry among the items, or -1-position among the unbounded ones
+		self._positions = array("i", [0]) * len(self.objects)
+		for index,obj in enumerate(self.objects):
+			box = obj.bbox()
+			if box is None:
+				self._positions[index] = -1-len(self.unbounded)
+				self.unbounded.append(obj)
+			else:
+				self._positions[index] = len(bounded)
+				bounded.append(index)
+				boxes.extend(box)
+		self.bounds, self.firsts, self.sizes, self.axes, order = _buildBVH(boxes, len(bounded), self.leafsize)
+		self.items = [self.objects[bounded[i]] for i in order]
+		for position,i in enumerate(order):
+			self._positions[bounded[i]] = position
+		#links from the items to their leaf nodes and from the nodes to their parents, for refitting
+		nodecount = len(self.sizes)
+		self._leaves = array("i", [0]) * len(self.items)
+		self._parents = array("i", [-1]) * nodecount
+		self._costs = array("d", [0.0]) * nodecount
+		for node in xrange(nodecount):
+			first,size = self.firsts[node],self.sizes[node]
+			if size:
+				self._leaves[first:first+size] = array("i", [node]) * size
+			elif self.items:
+				self._parents[first] = self._parents[first+1] = node
+			self._costs[node] = self._nodecost(node)
+		self._costsum = sum(self._costs)
+		self.buildcost = self.cost()
+
+	def _nodecost(self, node):
+		#surface area heuristic, the chance of a ray visiting the node times the tests it then makes
+		return _boxarea(self.bounds, node) * (self.sizes[node] or 1)
+
+	def cost(self):
+		"""
+		The expected nr of box and geometry tests made by a ray that passes through the hierarchy,
+		by the surface area heuristic. Grows as refitting makes the boxes overlap more.
+		"""
+		if not self.items:
+			return 0.0
+		area = _boxarea(self.bounds, 0)
+		return self._costsum / area if area > 0 else 0.0
+
+	def refit(self, objects=None):
+		"""
+		Updates the hierarchy after geometries have moved or been replaced, by only resizing the
+		boxes around those that changed. Rebuilds it instead if that has made it too slow (see
+		REFIT_LIMIT), or if geometries have been added or removed or have become (un)bounded.
+		Returns True if it was rebuilt.
+
+		- *objects: the geometries, replacing those given before in the same order. If not given, all geometries are assumed to have moved in place.
+		"""
+		if objects is None:
+			changed = xrange(len(self.objects))
+		else:
+			objects = list(objects)
+			if len(objects) != len(self.objects):
+				self.objects = objects
+				self.build()
+				return True
+			changed = [index for index,(new,old) in enumerate(zip(objects,self.objects)) if new is not old]
+			self.objects = objects
+		nodes = set()
+		for index in changed:
+			obj = self.objects[index]
+			position = self._positions[index]
+			if (obj.bbox() is None) != (position < 0):
+				self.build()
+				return True
+			if position < 0:
+				self.unbounded[-1-position] = obj
+			else:
+				self.items[position] = obj
+				#the leaf and all boxes above it
+				node = self._leaves[position]
+				while node >= 0 and node not in nodes:
+					nodes.add(node)
+					node = self._parents[node]
+		#children always come after their parents, so are resized first
+		bounds,firsts,sizes,items = self.bounds,self.firsts,self.sizes,self.items
+		for node in sorted(nodes, reverse=True):
+			first,size = firsts[node],sizes[node]
+			if size:
+				boxes = [obj.bbox() for obj in items[first:first+size]]
+				box = [min(box[axis] for box in boxes) for axis in xrange(3)] + [max(box[axis] for box in boxes) for axis in xrange(3,6)]
+			else:
+				l,r = 6*first,6*first+6
+				box = [min(bounds[l+axis], bounds[r+axis]) for axis in xrange(3)] + [max(bounds[l+axis], bounds[r+axis]) for axis in xrange(3,6)]
+			bounds[6*node:6*node+6] = array("d", box)
+			cost = self._nodecost(node)
+			self._costsum += cost - self._costs[node]
+			self._costs[node] = cost
+		if self.cost() > REFIT_LIMIT * self.buildcost:
+			self.build()
+			return True
+		return False
+
+	def bbox(self):
+		if self.unbounded: return None
+		return tuple(self.bounds[0:6])
+
+	def intersect(self, ray, ignore=None):
+		best,bestobj = self._closest(ray, ignore, 0)
+		if bestobj is None:
+			return NOINTERSECTION
+		return _intersection(ray, best, bestobj)
+
+	def hit(self, ray):
+		"""
+		Lets the hierarchy itself be used as a geometry, eg in the list of geometries of another scene.
+		Returns the distance to the closest hit beyond EPSILON, and keeps the geometry that was hit as lasthit.
+		"""
+		best,self.lasthit = self._closest(ray, None, EPSILON)
+		return best
+
+	def _closest(self, ray, ignore, tmin):
+		best,bestobj = NOHIT,None
+		if self.items:
+			best,bestobj = self._traverse(ray, ignore, tmin)
+		stats = _stats
+		#unbounded ones last, so that like in a list they lose ties to bounded ones listed before them
+		for obj in self.unbounded:
+			if obj is not ignore:
+				if stats is not None: stats.test(obj)
+				d = obj.hit(ray)
+				if d > tmin and (d < best or best < 0):
+					best = d
+					bestobj = getattr(obj, "lasthit", obj)
+		return best,bestobj
+
+	def occluded(self, ray, tmax, ignore=None):
+		stats = _stats
+		for obj in self.unbounded:
+			if obj is not ignore:
+				if stats is not None: stats.test(obj)
+				if _blocks(obj, ray, tmax):
+					return True
+		if not self.items:
+			return False
+		ox,oy,oz = ray.o.x,ray.o.y,ray.o.z
+		dx,dy,dz = ray.d.x,ray.d.y,ray.d.z
+		ix = 1.0/dx if dx else 1e300
+		iy = 1.0/dy if dy else 1e300
+		iz = 1.0/dz if dz else 1e300
+		bounds,firsts,sizes,items = self.bounds,self.firsts,self.sizes,self.items
+		#any hit will do, so no need to visit the nearest boxes first
+		stack = [0]
+		while stack:
+			node = stack.pop()
+			b = 6*node
+			t1 = (bounds[b]-ox)*ix
+			t2 = (bounds[b+3]-ox)*ix
+			if t1 > t2: t1,t2 = t2,t1
+			t3 = (bounds[b+1]-oy)*iy
+			t4 = (bounds[b+4]-oy)*iy
+			if t3 > t4: t3,t4 = t4,t3
+			if t3 > t1: t1 = t3
+			if t4 < t2: t2 = t4
+			t3 = (bounds[b+2]-oz)*iz
+			t4 = (bounds[b+5]-oz)*iz
+			if t3 > t4: t3,t4 = t4,t3
+			if t3 > t1: t1 = t3
+			if t4 < t2: t2 = t4
+			if t2 < t1 or t2 < 0 or t1 > tmax:
+				continue
+			size = sizes[node]
+			first = firsts[node]
+			if size:
+				for obj in items[first:first+size]:
+					if obj is not ignore:
+						if stats is not None: stats.test(obj)
+						if _blocks(obj, ray, tmax):
+							return True
+			else:
+				stack.append(first)
+				stack.append(first+1)
+		return False
+
+	def _traverse(self, ray, ignore, tmin):
+		ox,oy,oz = ray.o.x,ray.o.y,ray.o.z
+		#inverse ray direction for the box slab tests, huge instead of infinite when parallel
+		dx,dy,dz = ray.d.x,ray.d.y,ray.d.z
+		ix = 1.0/dx if dx else 1e300
+		iy = 1.0/dy if dy else 1e300
+		iz = 1.0/dz if dz else 1e300
+		negative = (dx < 0, dy < 0, dz < 0)
+		bounds,firsts,sizes,axes,items = self.bounds,self.firsts,self.sizes,self.axes,self.items
+		stats = _stats
+		best = float("inf")
+		bestobj = None
+		stack = [0]
+		while stack:
+			node = stack.pop()
+			b = 6*node
+			t1 = (bounds[b]-ox)*ix
+			t2 = (bounds[b+3]-ox)*ix
+			if t1 > t2: t1,t2 = t2,t1
+			t3 = (bounds[b+1]-oy)*iy
+			t4 = (bounds[b+4]-oy)*iy
+			if t3 > t4: t3,t4 = t4,t3
+			if t3 > t1: t1 = t3
+			if t4 < t2: t2 = t4
+			t3 = (bounds[b+2]-oz)*iz
+			t4 = (bounds[b+5]-oz)*iz
+			if t3 > t4: t3,t4 = t4,t3
+			if t3 > t1: t1 = t3
+			if t4 < t2: t2 = t4
+			if t2 < t1 or t2 < 0 or t1 > best:
+				continue
+			size = sizes[node]
+			if size:
+				first = firsts[node]
+				for obj in items[first:first+size]:
+					if obj is not ignore:
+						if stats is not None: stats.test(obj)
+						d = obj.hit(ray)
+						if tmin < d < best:
+							best = d
+							bestobj = getattr(obj, "lasthit", obj)
+			else:
+				#visit the child nearest along the split axis first
+				left = firsts[node]
+				if negative[axes[node]]:
+					stack.append(left)
+					stack.append(left+1)
+				else:
+					stack.append(left+1)
+					stack.append(left)
+		if bestobj is None:
+			return NOHIT,None
+		return best,bestobj
+
+#the nr of grid cells per geometry that the resolution of a Grid is picked for
+GRID_DENSITY = 2
+#the max nr of cells along each side of a Grid
+GRID_MAXRESOLUTION = 256
+
+class Grid( object ):
+	"""
+	A uniform grid of equally sized cells over the scene, each listing the geometries that overlap it,
+	which a ray steps through cell by cell (3D-DDA) from front to back. Faster to build than a BVH and
+	often faster to traverse when the geometries are many, of similar size and evenly spread out.
+	Can be given to testRay or trace in place of a list of geometries, just like a BVH.
+	Infinite geometries (ie planes) have no bounds and are kept outside the grid.
+
+	- objects: a list of geometry object instances
+	- *resolution: the nr of cells along the x, y and z sides, by default picked from the nr of geometries and the shape of the scene
+	"""
+	def __init__(self, objects, resolution=None):
+		self.objects = list(objects)
+		self.resolution = resolution
+		self.build()
+
+	def build(self):
+		self.unbounded = []
+		self.items = []
+		boxes = []
+		for obj in self.objects:
+			box = obj.bbox()
+			if box is None:
+				self.unbounded.append(obj)
+			else:
+				self.items.append(obj)
+				boxes.append(box)
+		if not boxes:
+			self.box = None
+			self.cellstarts,self.cellitems = array("i", [0,0]),array("i")
+			return
+		x1,y1,z1 = [min(box[axis] for box in boxes) for axis in xrange(3)]
+		x2,y2,z2 = [max(box[axis] for box in boxes) for axis in xrange(3,6)]
+		#flat scenes still need some thickness to divide
+		pad = max(x2-x1, y2-y1, z2-z1, 1.0) * 1e-6
+		self.box = (x1-pad, y1-pad, z1-pad, x2+pad, y2+pad, z2+pad)
+		extents = [self.box[axis+3]-self.box[axis] for axis in xrange(3)]
+		if self.resolution is None:
+			#cubical cells, about GRID_DENSITY per geometry
+			cellsize = (extents[0]*extents[1]*extents[2] / (GRID_DENSITY*len(boxes))) ** (1/3.0)
+			resolution = [min(max(int(extent/cellsize), 1), GRID_MAXRESOLUTION) for extent in extents]
+		else:
+			resolution = list(self.resolution)
+		self.res = resolution
+		self.cellsize = [extent/res for extent,res in zip(extents,resolution)]
+		#the geometries of each cell are stored together, starting at cellstarts[cell] in cellitems
+		ranges = [self._cellrange(box) for box in boxes]
+		counts = array("i", [0]) * (resolution[0]*resolution[1]*resolution[2] + 1)
+		for index,cells in enumerate(ranges):
+			for cell in self._cells(cells):
+				counts[cell+1] += 1
+		for cell in xrange(1, len(counts)):
+			counts[cell] += counts[cell-1]
+		self.cellstarts = counts
+		self.cellitems = array("i", [0]) * counts[-1]
+		filled = array("i", counts[:-1])
+		for index,cells in enumerate(ranges):
+			for cell in self._cells(cells):
+				self.cellitems[filled[cell]] = index
+				filled[cell] += 1
+
+	def _cellrange(self, box):
+		#the first and last cell along each side that a box overlaps
+		cells = []
+		for axis in xrange(3):
+			low = int((box[axis]-self.box[axis]) / self.cellsize[axis])
+			high = int((box[axis+3]-self.box[axis]) / self.cellsize[axis])
+			cells.append((min(max(low,0), self.res[axis]-1), min(max(high,0), self.res[axis]-1)))
+		return cells
+
+	def _cells(self, cells):
+		(xa,xb),(ya,yb),(za,zb) = cells
+		nx,ny = self.res[0],self.res[1]
+		for z in xrange(za, zb+1):
+			for y in xrange(ya, yb+1):
+				for x in xrange(xa, xb+1):
+					yield x + nx*(y + ny*z)
+
+	def bbox(self):
+		if self.unbounded: return None
+		return self.box
+
+	def intersect(self, ray, ignore=None):
+		best,bestobj = self._closest(ray, ignore, 0)
+		if bestobj is None:
+			return NOINTERSECTION
+		return _intersection(ray, best, bestobj)
+
+	def hit(self, ray):
+		"""
+		Lets the grid itself be used as a geometry, eg in the list of geometries of another scene.
+		Returns the distance to the closest hit beyond EPSILON, and keeps the geometry that was hit as lasthit.
+		"""
+		best,self.lasthit = self._closest(ray, None, EPSILON)
+		return best
+
+	def _closest(self, ray, ignore, tmin):
+		best,bestobj = NOHIT,None
+		if self.box is not None:
+			best,bestobj = self._traverse(ray, ignore, tmin, float("inf"), False)
+		stats = _stats
+		#unbounded ones last, so that like in a list they lose ties to bounded ones listed before them
+		for obj in self.unbounded:
+			if obj is not ignore:
+				if stats is not None: stats.test(obj)
+				d = obj.hit(ray)
+				if d > tmin and (d < best or best < 0):
+					best = d
+					bestobj = getattr(obj, "lasthit", obj)
+		return best,bestobj
+
+	def occluded(self, ray, tmax, ignore=None):
+		stats = _stats
+		for obj in self.unbounded:
+			if obj is not ignore:
+				if stats is not None: stats.test(obj)
+				if _blocks(obj, ray, tmax):
+					return True
+		if self.box is None:
+			return False
+		return self._traverse(ray, ignore, EPSILON, tmax, True)[1] is not None
+
+	def _traverse(self, ray, ignore, tmin, tmax, anyhit):
+		#the closest hit between tmin and tmax, or with anyhit the first one found
+		ox,oy,oz = ray.o.x,ray.o.y,ray.o.z
+		dx,dy,dz = ray.d.x,ray.d.y,ray.d.z
+		ix = 1.0/dx if dx else 1e300
+		iy = 1.0/dy if dy else 1e300
+		iz = 1.0/dz if dz else 1e300
+		box = self.box
+		#where the ray enters and leaves the grid
+		t1 = (box[0]-ox)*ix
+		t2 = (box[3]-ox)*ix
+		if t1 > t2: t1,t2 = t2,t1
+		t3 = (box[1]-oy)*iy
+		t4 = (box[4]-oy)*iy
+		if t3 > t4: t3,t4 = t4,t3
+		if t3 > t1: t1 = t3
+		if t4 < t2: t2 = t4
+		t3 = (box[2]-oz)*iz
+		t4 = (box[5]-oz)*iz
+		if t3 > t4: t3,t4 = t4,t3
+		if t3 > t1: t1 = t3
+		if t4 < t2: t2 = t4
+		if t2 < t1 or t2 < 0 or t1 > tmax:
+			return NOHIT,None
+		tenter = max(t1, 0.0)
+		texit = min(t2, tmax)
+		nx,ny,nz = self.res
+		sx,sy,sz = self.cellsize
+		#the starting cell, and for each side the step direction, the distance to the next cell border and between borders
+		cells = []
+		for o,d,i,low,size,n in ((ox,dx,ix,box[0],sx,nx), (oy,dy,iy,box[1],sy,ny), (oz,dz,iz,box[2],sz,nz)):
+			cell = min(max(int((o+d*tenter-low)/size), 0), n-1)
+			if d > 0:
+				cells.append((cell, 1, (low+(cell+1)*size-o)*i, size*i))
+			elif d < 0:
+				cells.append((cell, -1, (low+cell*size-o)*i, -size*i))
+			else:
+				cells.append((cell, 0, float("inf"), float("inf")))
+		(cx,stepx,nextx,deltax),(cy,stepy,nexty,deltay),(cz,stepz,nextz,deltaz) = cells
+		starts,cellitems,items = self.cellstarts,self.cellitems,self.items
+		stats = _stats
+		best = tmax
+		bestobj = None
+		#geometries can overlap several cells but are only tested once per ray
+		tested = dict()
+		while True:
+			cell = cx + nx*(cy + ny*cz)
+			for k in xrange(starts[cell], starts[cell+1]):
+				index = cellitems[k]
+				if index in tested:
+					d,obj = tested[index]
+				else:
+					obj = items[index]
+					if obj is ignore:
+						continue
+					if stats is not None: stats.test(obj)
+					if anyhit:
+						#any blocking hit will do, so it need not be the closest one of the geometry
+						if _blocks(obj, ray, tmax):
+							return tmax,obj
+						tested[index] = NOHIT,obj
+						continue
+					d = obj.hit(ray)
+					obj = getattr(obj, "lasthit", obj)
+					tested[index] = d,obj
+				if tmin < d < best:
+					best = d
+					bestobj = obj
+					if anyhit:
+						return best,bestobj
+			#step into the neighbouring cell whose border is nearest
+			if nextx < nexty and nextx < nextz:
+				tnext = nextx
+				cx += stepx
+				nextx += deltax
+				inside = 0 <= cx < nx
+			elif nexty < nextz:
+				tnext = nexty
+				cy += stepy
+				nexty += deltay
+				inside = 0 <= cy < ny
+			else:
+				tnext = nextz
+				cz += stepz
+				nextz += deltaz
+				inside = 0 <= cz < nz
+			#hits within the cells passed so far cannot be beaten by those further on
+			if best <= tnext or tnext > texit or not inside:
+				break
+		if bestobj is None:
+			return NOHIT,None
+		return best,bestobj
+
+
+#the acceleration structures that renderScene can build by name
+ACCELERATORS = {"bvh": BVH, "grid": Grid}
+
+
+#VECTORIZED RENDERING
+def _vecarray(vector):
+	return numpy.array((vector.x, vector.y, vector.z))
+
+def _perpendicularsarray(units):
+	#the array version of _perpendiculars, for an (n,3) array of unit vectors
+	axes = numpy.where((numpy.abs(units[:,0]) < 0.9)[:,None], (1.0,0.0,0.0), (0.0,1.0,0.0))
+	u = numpy.cross(axes, units)
+	u /= numpy.sqrt((u*u).sum(axis=1))[:,None]
+	return u, numpy.cross(units, u)
+
+def _transformarray(matrix, points, translate=True):
+	"""
+	An (n,3) array of points (or directions, if not translate) transformed by a Matrix4.
+	"""
+	M = matrix
+	rotation = numpy.array([[M.a,M.b,M.c], [M.e,M.f,M.g], [M.i,M.j,M.k]])
+	points = points.dot(rotation.T)
+	if translate:
+		points = points + (M.d,M.h,M.l)
+	return points
+
+def _checkarrays(objs):
+	"""
+	Raises a ValueError naming the first of the geometries that the numpy backend cannot render,
+	ie that have no hitarray, normalarray and colorarray methods, so it fails before rendering starts.
+	"""
+	for obj in objs:
+		#instances render with the array methods of the geometry inside them
+		while isinstance(obj, Instance):
+			obj = obj.geometry
+		if not all(hasattr(obj, name) for name in ("hitarray", "normalarray", "colorarray")):
+			raise ValueError("%s geometries can only be rendered with the python backend" % type(obj).__name__)
+
+def _hitarray(obj, origins, dirs):
+	"""
+	Distances along many rays at once to where they hit a geometry, or infinity if they miss.
+	"""
+	if _stats is not None:
+		_stats.test(obj, len(dirs))
+	return obj.hitarray(origins, dirs)
+
+def _tracearray(origin, dirs, objects, lights, spreads=None, costs=None):
+	"""
+	The array version of trace, shading a whole packet of rays from the same origin
+	at once. Returns their colors as an (n,3) float array, and their hit distances
+	(infinite where they hit nothing). If given a costs array, adds the nr of
+	intersection tests made for each ray to it. Like _shade follows the rays mirrored
+	and let through by materials, as a new packet for each bounce.
+	"""
+	count = len(dirs)
+	cols = numpy.zeros((count,3))
+	origins = numpy.broadcast_to(origin, dirs.shape)
+	#the ray that each ray of the packet adds its color to, and the fraction it adds
+	rays = numpy.arange(count)
+	throughputs = numpy.ones(count)
+	firstdist = None
+	rand = None
+	depth = 0
+	while True:
+		if _stats is not None and depth > _stats.maxdepth:
+			_stats.maxdepth = depth
+		raycosts = numpy.zeros(len(dirs), numpy.int64) if costs is not None else None
+		colors,dist,hitobj,normals = _shadearray(origins, dirs, objects, lights, spreads, raycosts)
+		if costs is not None:
+			numpy.add.at(costs, rays, raycosts)
+		if firstdist is None:
+			firstdist = dist
+		own = numpy.ones(len(dirs))
+		bounces = []
+		if depth < MAX_RECURSION:
+			for index,obj in enumerate(objects):
+				material = getattr(obj, "material", None)
+				if material is None or not (material.reflectivity or material.transparency):
+					continue
+				sel = numpy.nonzero(hitobj == index)[0]
+				if len(sel):
+					own[sel] = 1 - material.reflectivity - material.transparency
+					points = origins[sel] + dirs[sel] * dist[sel][:,None]
+					bounces.extend(_bouncearray(points, dirs[sel], normals[sel], material, rays[sel], throughputs[sel]))
+		numpy.add.at(cols, rays, colors * (throughputs*own)[:,None])
+		if not bounces:
+			return cols, firstdist
+		origins = numpy.concatenate([bounce[0] for bounce in bounces])
+		dirs = numpy.concatenate([bounce[1] for bounce in bounces])
+		rays = numpy.concatenate([bounce[2] for bounce in bounces])
+		throughputs = numpy.concatenate([bounce[3] for bounce in bounces])
+		faint = throughputs < ROULETTE_THROUGHPUT
+		if faint.any():
+			if rand is None:
+				rand = numpy.random.RandomState(_RANDOM.getrandbits(32))
+			#the survivors make up for the others
+			keep = ~faint | (rand.random_sample(len(throughputs))*ROULETTE_THROUGHPUT < throughputs)
+			throughputs = numpy.where(faint, ROULETTE_THROUGHPUT, throughputs)
+			origins,dirs,rays,throughputs = origins[keep],dirs[keep],rays[keep],throughputs[keep]
+			if not len(rays):
+				return cols, firstdist
+		spreads = None
+		depth += 1
+
+def _bouncearray(points, dirs, normals, material, rays, throughputs):
+	"""
+	The array version of _bounce, returning for the rays mirrored and for those let through
+	their origins, directions, the ray they add their color to, and their throughputs.
+	"""
+	cosines = -(dirs*normals).sum(axis=1)
+	#leaving the inside of the geometry
+	inside = cosines < 0
+	normals = numpy.where(inside[:,None], -normals, normals)
+	cosines = numpy.abs(cosines)
+	ratios = numpy.where(inside, material.refraction, 1.0/material.refraction)
+	reflectivities = numpy.full(len(dirs), float(material.reflectivity))
+	bounces = []
+	if material.transparency:
+		k = 1 - ratios*ratios*(1 - cosines*cosines)
+		#too glancing to leave, so all of it is reflected inside
+		leaves = k >= 0
+		reflectivities[~leaves] += material.transparency
+		m = ratios*cosines - numpy.sqrt(numpy.maximum(k, 0))
+		through = dirs*ratios[:,None] + normals*m[:,None]
+		bounces.append((points[leaves] - normals[leaves]*EPSILON, through[leaves], rays[leaves], throughputs[leaves]*material.transparency))
+	mirrored = reflectivities > 0
+	if mirrored.any():
+		reflected = dirs + normals*(2*cosines)[:,None]
+		bounces.append((points[mirrored] + normals[mirrored]*EPSILON, reflected[mirrored], rays[mirrored], throughputs[mirrored]*reflectivities[mirrored]))
+	return bounces
+
+def _shadearray(origins, dirs, objects, lights, spreads=None, costs=None):
+	"""
+	The array version of _directlight, for a packet of rays. Returns the colors they see, their hit
+	distances (infinite where they hit nothing), the index of the geometry each hits (-1 for none),
+	and the unit normals where they hit.
+	"""
+	count = len(dirs)
+	if costs is not None:
+		costs += len(objects)
+	dist = numpy.full(count, numpy.inf)
+	hitobj = numpy.full(count, -1)
+	for index,obj in enumerate(objects):
+		t = _hitarray(obj, origins, dirs)
+		closer = t < dist
+		dist[closer] = t[closer]
+		hitobj[closer] = index
+	#hits nothing
+	cols = numpy.full((count,3), AMBIENT)
+	allnormals = numpy.zeros((count,3))
+	for index,obj in enumerate(objects):
+		sel = numpy.nonzero(hitobj == index)[0]
+		if not len(sel):
+			continue
+		points = origins[sel] + dirs[sel] * dist[sel][:,None]
+		normals = obj.normalarray(points)
+		footprints = None
+		if spreads is not None:
+			cosines = numpy.abs((normals*dirs[sel]).sum(axis=1)) / numpy.sqrt((normals*normals).sum(axis=1))
+			footprints = spreads[sel] * dist[sel] / numpy.maximum(cosines, 0.1)
+		if isinstance(obj, Instance):
+			#instances scale the footprints into the coordinates of their geometry along the rays
+			colors = obj.colorarray(points, footprints, dirs[sel])
+		else:
+			colors = obj.colorarray(points, footprints)
+		unitnormals = normals / numpy.sqrt((normals*normals).sum(axis=1))[:,None]
+		allnormals[sel] = unitnormals
+		brightness = numpy.zeros(len(sel))
+		for light,rows,weights in _lightarrays(lights, points, normals):
+			if light.size:
+				brightness[rows] += weights*_arealightarray(light, points[rows], unitnormals[rows], objects, costs, sel[rows])
+				continue
+			tolight = _vecarray(light) - points[rows]
+			lightdist = numpy.sqrt((tolight*tolight).sum(axis=1))
+			lightdirs = tolight / lightdist[:,None]
+			lightIntensity = light.strength/(4*pi*lightdist**2)
+			#camera sees shadow part of object (not hit by light), or the light is too far away to matter
+			litsel = numpy.nonzero(((normals[rows]*tolight).sum(axis=1) > 0) & (lightIntensity >= LIGHT_CUTOFF))[0]
+			#shadow rays towards the light for the rest
+			litsel = litsel[_unblockedarray(points[rows[litsel]], lightdirs[litsel], lightdist[litsel], objects, costs, sel[rows[litsel]])]
+			#camera sees obj in light
+			brightness[rows[litsel]] += weights[litsel]*((unitnormals[rows[litsel]]*lightdirs[litsel]).sum(axis=1)*lightIntensity[litsel])
+		cols[sel] = colors * numpy.maximum(brightness, AMBIENT)[:,None]
+	return cols, dist, hitobj, allnormals
+
+def _unblockedarray(points, dirs, dists, objects, costs=None, costrows=None):
+	"""
+	The array version of occluded, for shadow rays from points in unit directions towards lights at the
+	given distances. Returns the indexes of the rays that nothing blocks. If given a costs array, adds
+	the intersection tests made to it at the costrows of the rays.
+	"""
+	unblocked = numpy.arange(len(points))
+	if _stats is not None:
+		_stats.shadowrays += len(points)
+	for other in objects:
+		if len(unblocked):
+			if costs is not None:
+				costs[costrows[unblocked]] += 1
+			t = _hitarray(other, points[unblocked], dirs[unblocked])
+			blocked = (t > EPSILON) & (t < dists[unblocked])
+			unblocked = unblocked[~blocked]
+	return unblocked
+
+def _arealightarray(light, points, unitnormals, objects, costs=None, costrows=None):
+	"""
+	The array version of _arealight, for an (n,3) array of points with unit normals.
+	"""
+	count = len(points)
+	total = numpy.zeros(count)
+	taken = numpy.zeros(count)
+	#the area light is left out where it is too far away or behind the surface
+	tolight = _vecarray(light) - points
+	lightdist = numpy.sqrt((tolight*tolight).sum(axis=1))
+	lightIntensity = light.strength/(4*pi*numpy.maximum(lightdist-light.size, EPSILON)**2)
+	rows = numpy.nonzero(((unitnormals*tolight).sum(axis=1) > -light.size) & (lightIntensity >= LIGHT_CUTOFF))[0]
+	rand = numpy.random.RandomState(_RANDOM.getrandbits(32))
+	for side in (SHADOW_SAMPLES, PENUMBRA_SAMPLES):
+		if not len(rows):
+			break
+		targets = light.samplearray(points[rows], side, rand)
+		#how many of the shadow rays of each point are sent, and how many of those reach the light
+		sent = numpy.zeros(len(rows), int)
+		lit = numpy.zeros(len(rows), int)
+		for sample in xrange(side*side):
+			tolight = targets[:,sample] - points[rows]
+			cosines = (unitnormals[rows]*tolight).sum(axis=1)
+			facing = numpy.nonzero(cosines > 0)[0]
+			lightdist = numpy.sqrt((tolight[facing]*tolight[facing]).sum(axis=1))
+			unblocked = _unblockedarray(points[rows[facing]], tolight[facing] / lightdist[:,None], lightdist, objects, costs, costrows[rows[facing]] if costs is not None else None)
+			sent[facing] += 1
+			lit[facing[unblocked]] += 1
+			total[rows[facing[unblocked]]] += cosines[facing[unblocked]] / lightdist[unblocked]**3
+		taken[rows] += side*side
+		rows = rows[(lit > 0) & (lit < sent)]
+	return light.strength/(4*pi) * total/numpy.maximum(taken, 1)
+
+_LIGHTCHUNK = 4096
+
+def _lightarrays(lights, points, normals):
+	"""
+	The array version of _samplelights, yielding the lights to shade a packet of surface points with
+	one at a time, each with the indexes of the points it lights and their weights. Points with no more
+	than LIGHT_SAMPLES lights near enough to matter get all of them, the others LIGHT_SAMPLES lights
+	picked at random in proportion to how much they could light them.
+	"""
+	count = len(points)
+	if len(lights) <= LIGHT_SAMPLES:
+		rows = numpy.arange(count)
+		for light in lights:
+			yield light, rows, numpy.ones(count)
+		return
+	positions = numpy.array([(light.x,light.y,light.z) for light in lights])
+	strengths = numpy.array([light.strength for light in lights])
+	sizes = numpy.array([light.size for light in lights])
+	rand = numpy.random.RandomState(_RANDOM.getrandbits(32))
+	#lights are picked for a chunk of points at a time, so the arrays over every light at every point stay small
+	for start in xrange(0, count, _LIGHTCHUNK):
+		chunkpoints = points[start:start+_LIGHTCHUNK]
+		chunknormals = normals[start:start+_LIGHTCHUNK]
+		chunk = len(chunkpoints)
+		tolights = positions[None,:,:] - chunkpoints[:,None,:]
+		lightdists = numpy.sqrt((tolights*tolights).sum(axis=2))
+		facing = (chunknormals[:,None,:]*tolights).sum(axis=2) / numpy.sqrt((chunknormals*chunknormals).sum(axis=1))[:,None]
+		intensities = strengths/(4*pi*numpy.maximum(lightdists-sizes, EPSILON)**2)
+		near = (facing > -sizes) & (intensities >= LIGHT_CUTOFF)
+		estimates = numpy.where(near, intensities*numpy.minimum((facing+sizes)/lightdists, 1.0), 0.0)
+		few = (estimates > 0).sum(axis=1) <= LIGHT_SAMPLES
+		cumulative = estimates.cumsum(axis=1)
+		total = cumulative[:,-1]
+		#the light each sample picks is the first whose cumulative estimate passes the random draw
+		draws = rand.random_sample((chunk,LIGHT_SAMPLES))*total[:,None]
+		picks = numpy.empty((chunk,LIGHT_SAMPLES), int)
+		for row in xrange(chunk):
+			picks[row] = numpy.searchsorted(cumulative[row], draws[row], side="right")
+		picks = numpy.minimum(picks, len(lights)-1)
+		for index,light in enumerate(lights):
+			#lights picked more than once get their weights added up
+			picked = (picks == index).sum(axis=1)
+			estimate = numpy.maximum(estimates[:,index], 1e-300)
+			weights = numpy.where(few, (estimates[:,index] > 0).astype(float), picked*total/(estimate*LIGHT_SAMPLES))
+			rows = numpy.nonzero(weights > 0)[0]
+			if len(rows):
+				yield light, start+rows, weights[rows]
+
+def _renderarray(camera, lights, objs, imagedims, tile, costs=None):
+	"""
+	Renders all pixels of an image tile (x1,y1,x2,y2) at once as a numpy ray packet,
+	with the same camera and shading as the python renderer. Returns the tile pixels
+	as a (height,width,3) byte array, and the (height*width,3) points they see (nan
+	where they see nothing). If given a (height*width) costs array, adds the nr of
+	intersection tests made for each pixel to it.
+	"""
+	if numpy is None:
+		raise ImportError("the numpy backend requires numpy to be installed")
+	imgwidth,imgheight = imagedims
+	x1,y1,x2,y2 = tile
+	grid = numpy.frombuffer(camera.raydirections(imagedims)).reshape(imgheight,imgwidth,4)
+	grid = grid[y1:y2, x1:x2].reshape(-1,4)
+	dirs = numpy.ascontiguousarray(grid[:,:3])
+	spreads = grid[:,3]
+	cols,dist = _tracearray(_vecarray(camera.pos), dirs, objs, lights, spreads, costs)
+	table = numpy.frombuffer(_gammatable(GAMMA_CORRECTION), numpy.uint8)
+	pixels = table[numpy.clip(cols*GAMMA_STEPS, 0, len(table)-1).astype(numpy.intp)]
+	points = _vecarray(camera.pos) + dirs * numpy.where(numpy.isfinite(dist), dist, numpy.nan)[:,None]
+	return pixels.reshape(y2-y1,x2-x1,3), points
+
+
+#TILED RENDERING
+def _framegeometries(objs, backend, bvh):
+	"""
+	The geometries to render a frame of an animation with. For the python backend these are put in
+	a hierarchy, built for the first frame and kept in the bvh list to be refitted for the next ones.
+	"""
+	if backend != "python":
+		return objs
+	if bvh:
+		bvh[0].refit(objs)
+	else:
+		bvh.append(BVH(objs))
+	return [bvh[0]]
+
+def _rendertile(camera, lights, objs, imagedims, tile, backend, framebuffer, offset=(0,0), hitpoints=None, costs=None):
+	"""
+	Renders the pixels of an image tile (x1,y1,x2,y2), given in image coordinates
+	where y goes downwards, into a framebuffer whose top left corner is at offset.
+	If given a hitpoints array laid out like the framebuffer but with 3 floats per pixel,
+	also records the point each pixel sees there (x is nan where it sees nothing).
+	If given a costs array laid out like the framebuffer but with 1 integer per pixel,
+	also records the nr of intersection tests made for each pixel there, which
+	requires that render stats are being collected.
+	"""
+	x1,y1,x2,y2 = tile
+	offx,offy = offset
+	if _stats is not None:
+		_stats.primaryrays += (x2-x1)*(y2-y1)
+	#the same faint rays are followed whichever order or process the tiles are rendered in
+	_RANDOM.seed(x1 + imagedims[0]*y1)
+	if backend == "numpy":
+		tilecosts = numpy.zeros((y2-y1)*(x2-x1), numpy.int64) if costs is not None else None
+		pixels,points = _renderarray(camera, lights, objs, imagedims, tile, tilecosts)
+		framebuffer.array()[y1-offy:y2-offy, x1-offx:x2-offx] = pixels
+		if hitpoints is not None:
+			_pastevalues(hitpoints, framebuffer.width, (x1-offx,y1-offy,x2-offx,y2-offy), array("d", points.ravel()), 3)
+		if costs is not None:
+			_pastevalues(costs, framebuffer.width, (x1-offx,y1-offy,x2-offx,y2-offy), array(costs.typecode, tilecosts), 1)
+		return
+	elif backend != "python":
+		raise ValueError("unknown backend: %s" % backend)
+	imgwidth = imagedims[0]
+	data,width = framebuffer.data,framebuffer.width
+	directions = camera.raydirections(imagedims)
+	for y in xrange(y1,y2):
+		row = []
+		for x in xrange(x1,x2):
+			j = 4*(y*imgwidth + x)
+			if costs is not None:
+				before = _stats.testcount
+			ray = Ray( camera.pos, _vector(directions[j],directions[j+1],directions[j+2]), directions[j+3])
+			intersect = testRay(ray, objs)
+			col = _shade(ray, intersect, objs, lights, MAX_RECURSION)
+			row.extend((col.x,col.y,col.z))
+			if costs is not None:
+				costs[(y-offy)*width + x-offx] = _stats.testcount - before
+			if hitpoints is not None:
+				i = 3*((y-offy)*width + x-offx)
+				if intersect.d == NOHIT:
+					hitpoints[i] = NAN
+				else:
+					p = intersect.p
+					hitpoints[i] = p.x
+					hitpoints[i+1] = p.y
+					hitpoints[i+2] = p.z
+		#gamma correct and clamp the whole row at once
+		i = 3*((y-offy)*width + x1-offx)
+		data[i:i+len(row)] = _gammabytes(row, GAMMA_CORRECTION)
+
+def _pastevalues(target, width, tile, values, channels):
+	"""
+	Writes the per pixel values of a tile (x1,y1,x2,y2), with the given nr of values per pixel,
+	into a flat array laid out like an image of the given width.
+	"""
+	x1,y1,x2,y2 = tile
+	rowsize = channels*(x2-x1)
+	for row in xrange(y2-y1):
+		i = channels*((y1+row)*width + x1)
+		target[i:i+rowsize] = values[row*rowsize:(row+1)*rowsize]
+
+#per pixel costs are kept as unsigned 32 bit ints
+COSTS_TYPECODE = "I"
+#the false colors of a heatmap, from the cheapest to the most expensive pixels
+HEATMAP_COLORS = [(0,0,128), (0,0,255), (0,255,255), (0,255,0), (255,255,0), (255,0,0)]
+
+def _encodeimage(img, savepath):
+	"""
+	The bytes of an image encoded in the file format given by the extension of the savepath.
+	"""
+	extension = os.path.splitext(savepath)[1].lower()
+	PIL.Image.init()
+	if extension not in PIL.Image.EXTENSION:
+		raise ValueError("unknown image file extension: %s" % extension)
+	data = io.BytesIO()
+	img.save(data, format=PIL.Image.EXTENSION[extension])
+	return data.getvalue()
+
+def _heatmap(costs, imagedims):
+	"""
+	A false color image of the per pixel costs, from dark blue for no cost to red for the highest cost.
+	"""
+	top = max(costs) or 1
+	scale = 255.0/top
+	img = PIL.Image.frombytes("L", imagedims, bytes(bytearray(int(cost*scale) for cost in costs)))
+	#stretch the color ramp over the 256 palette entries
+	palette = []
+	steps = len(HEATMAP_COLORS)-1
+	for i in xrange(256):
+		pos = i/255.0*steps
+		lower = min(int(pos), steps-1)
+		frac = pos-lower
+		c1,c2 = HEATMAP_COLORS[lower],HEATMAP_COLORS[lower+1]
+		palette.extend(int(a+(b-a)*frac) for a,b in zip(c1,c2))
+	img = img.convert("P")
+	img.putpalette(palette)
+	return img.convert("RGB")
+
+def _screenbounds(camera, box, imagedims):
+	"""
+	The image pixel area (x1,y1,x2,y2) covered by a bounding box as seen by the camera,
+	the whole image if the box reaches behind the camera, or None if it is outside the image.
+	"""
+	imgwidth,imgheight = imagedims
+	xs,ys = [],[]
+	for x in (box[0],box[3]):
+		for y in (box[1],box[4]):
+			for z in (box[2],box[5]):
+				pixel = camera.project(Vector(x,y,z))
+				if pixel is None:
+					return (0,0,imgwidth,imgheight)
+				xs.append(pixel[0])
+				ys.append(imgheight-1-pixel[1])
+	x1 = max(int(math.floor(min(xs))), 0)
+	y1 = max(int(math.floor(min(ys))), 0)
+	x2 = min(int(math.ceil(max(xs)))+1, imgwidth)
+	y2 = min(int(math.ceil(max(ys)))+1, imgheight)
+	if x1 >= x2 or y1 >= y2:
+		return None
+	return (x1,y1,x2,y2)
+
+def _segmentbox(px, py, pz, qx, qy, qz, box):
+	#whether the line segment between two points passes through a bounding box
+	smin,smax = 0.0,1.0
+	for o,d,lo,hi in ((px,qx-px,box[0],box[3]), (py,qy-py,box[1],box[4]), (pz,qz-pz,box[2],box[5])):
+		if d == 0:
+			if o < lo or o > hi:
+				return False
+		else:
+			s1 = (lo-o)/d
+			s2 = (hi-o)/d
+			if s1 > s2: s1,s2 = s2,s1
+			if s1 > smin: smin = s1
+			if s2 < smax: smax = s2
+			if smin > smax:
+				return False
+	return True
+
+def _dirtytiles(camera, lights, boxes, imagedims, tiles, hitpoints):
+	"""
+	The tiles that may look different once geometries have moved, given the bounding boxes
+	they moved from and to. These are the tiles the boxes cover on screen, and the tiles
+	where a box comes in between a seen point (from the last rendered hitpoints) and a light
+	that reaches it (see LightSource.reach).
+	"""
+	imgwidth = imagedims[0]
+	areas = [_screenbounds(camera, box, imagedims) for box in boxes]
+	areas = [area for area in areas if area]
+	#a box is between a point and some part of an area light if it is between the point and the
+	#center of the light once grown by the size of the light
+	lightboxes = []
+	for light in lights:
+		s = light.size
+		#points further away are not lit by the light whether or not something is in between
+		reach = light.reach() + EPSILON
+		lightboxes.append((light, reach*reach, [(box[0]-s, box[1]-s, box[2]-s, box[3]+s, box[4]+s, box[5]+s) for box in boxes]))
+	dirty = []
+	for tile in tiles:
+		x1,y1,x2,y2 = tile
+		if any(x1 < area[2] and area[0] < x2 and y1 < area[3] and area[1] < y2 for area in areas):
+			dirty.append(tile)
+			continue
+		shadowed = False
+		for y in xrange(y1,y2):
+			for i in xrange(3*(y*imgwidth+x1), 3*(y*imgwidth+x2), 3):
+				px = hitpoints[i]
+				if px != px:
+					#nan, sees nothing
+					continue
+				py,pz = hitpoints[i+1],hitpoints[i+2]
+				for light,reach,grown in lightboxes:
+					if (light.x-px)**2 + (light.y-py)**2 + (light.z-pz)**2 > reach:
+						continue
+					for box in grown:
+						if _segmentbox(px, py, pz, light.x, light.y, light.z, box):
+							shadowed = True
+							break
+					if shadowed: break
+				if shadowed: break
+			if shadowed: break
+		if shadowed:
+			dirty.append(tile)
+	return dirty
+
+def _scheduletiles(camera, objs, imagedims, tilesize):
+	"""
+	Splits the image into tiles, ordered with the likely most expensive ones first,
+	ie those overlapped by the most geometries on screen. Handed out one by one to
+	whichever worker is free, this keeps the slow tiles from being left until the end.
+	"""
+	imgwidth,imgheight = imagedims
+	tiles = []
+	for y in xrange(0,imgheight,tilesize):
+		for x in xrange(0,imgwidth,tilesize):
+			tiles.append((x,y,min(x+tilesize,imgwidth),min(y+tilesize,imgheight)))
+	costs = dict((tile,1) for tile in tiles)
+	for obj in objs:
+		box = obj.bbox()
+		if box is None: continue
+		area = _screenbounds(camera, box, imagedims)
+		if area is None: continue
+		for tile in tiles:
+			if tile[0] < area[2] and area[0] < tile[2] and tile[1] < area[3] and area[1] < tile[3]:
+				costs[tile] += 1
+	tiles.sort(key=lambda tile: -costs[tile])
+	return tiles
+
+_workerscene = None
+
+def _initworker(scene):
+	#receives the scene once per worker process, not once per tile
+	global _workerscene
+	_workerscene = scene
+
+def _workertile(tile):
+	global _stats
+	camera, lights, objs, imagedims, backend, recordhits, countstats, recordcosts = _workerscene
+	x1,y1,x2,y2 = tile
+	framebuffer = Framebuffer((x2-x1,y2-y1))
+	hitpoints = array("d", [0.0]) * (3*(x2-x1)*(y2-y1)) if recordhits else None
+	costs = array(COSTS_TYPECODE, [0]) * ((x2-x1)*(y2-y1)) if recordcosts else None
+	#each tile sends back its own counts for the main process to add up
+	_stats = RenderStats() if countstats else None
+	_rendertile(camera, lights, objs, imagedims, tile, backend, framebuffer, offset=(x1,y1), hitpoints=hitpoints, costs=costs)
+	return tile, framebuffer.data, hitpoints, costs, _stats
+
+def _initframeworker(scene):
+	#receives the camera, light, static geometries and the hierarchy over them once per worker process, not once per frame
+	global _workerscene
+	_workerscene = scene + (Framebuffer(scene[3]),)
+
+def _workerframe(animated):
+	camera, lights, static, imagedims, backend, bvh, framebuffer = _workerscene
+	imgwidth,imgheight = imagedims
+	objs = _framegeometries(static + animated, backend, bvh)
+	_renderframe(camera, lights, objs, imagedims, [(0,0,imgwidth,imgheight)], framebuffer, None, backend, 1)
+	return framebuffer.data
+
+def _renderframe(camera, lights, objs, imagedims, tiles, framebuffer, accelerator, backend, workers, hitpoints=None, costs=None):
+	"""
+	Renders the given image tiles of the scene into the framebuffer (and hitpoints and costs, see _rendertile),
+	leaving the rest of it as it is.
+	"""
+	stats = _stats
+	if stats is not None: t = timer()
+	if accelerator is not None and backend == "python":
+		if accelerator not in ACCELERATORS:
+			raise ValueError("unknown accelerator: %s" % accelerator)
+		objs = ACCELERATORS[accelerator](objs)
+	#computed here so workers get them along with the camera
+	camera.raydirections(imagedims)
+	if stats is not None:
+		stats.addtime("setup", timer()-t)
+		t = timer()
+	if workers > 1:
+		pool = multiprocessing.Pool(workers, _initworker, ((camera, lights, objs, imagedims, backend, hitpoints is not None, stats is not None, costs is not None),))
+		finished = False
+		try:
+			for tile,data,points,tilecosts,tilestats in pool.imap_unordered(_workertile, tiles, chunksize=1):
+				if tilestats is not None:
+					stats.merge(tilestats)
+				framebuffer.paste(tile, data)
+				if points is not None:
+					_pastevalues(hitpoints, framebuffer.width, tile, points, 3)
+				if tilecosts is not None:
+					_pastevalues(costs, framebuffer.width, tile, tilecosts, 1)
+			finished = True
+		finally:
+			#if a tile fails or the render is interrupted, the tiles still queued are dropped instead of waited for
+			if finished:
+				pool.close()
+			else:
+				pool.terminate()
+			pool.join()
+	else:
+		for tile in tiles:
+			_rendertile(camera, lights, objs, imagedims, tile, backend, framebuffer, hitpoints=hitpoints, costs=costs)
+	if stats is not None:
+		stats.addtime("trace", timer()-t)
 
 
 #USER FUNCTIONS
@@ -385,16 +3259,124 @@ class Color(Vector):
 
 	- create with 3 RGB integer color argments: r, g, and b. 
 	"""
-	pass
+	__slots__ = ()
 
 class LightSource(Vector):
 	"""
-	A Lightsource instance. Creating multiple lightsources has no effect
-	since you can only pass one to you rendering function.
+	A Lightsource instance. Several can be given to the rendering functions as a list.
 	For now shines light in all directions, not focused on any particular spot.
+	A point light that casts hard shadows, see SphereLight and RectangleLight for soft ones.
 
 	- takes x, y, and z coordinates as arguments for the location of the lightsource. 
+	- *strength: how bright the light is, its brightness falls off with the square of the distance from it
 	"""
+	__slots__ = ("strength",)
+	#point lights have no size, area lights the radius around their position that they fit within
+	size = 0.0
+
+	def __init__(self, x, y, z, strength=1000.0):
+		Vector.__init__(self, x, y, z)
+		self.strength = float(strength)
+
+	def reach(self):
+		"""
+		How far away the light still lights things up more than LIGHT_CUTOFF, beyond that it is left out of the shading.
+		"""
+		return self.size + sqrt(self.strength/(4*pi*LIGHT_CUTOFF))
+
+class SphereLight(LightSource):
+	"""
+	A round area light, casting soft shadows whose penumbra widens with its radius. Shines in all
+	directions from the points of its surface, with the same total strength as a point light at its center.
+
+	- center: a vector instance of the center of the light
+	- radius: the radius of the light
+	- *strength: how bright the light is, see LightSource
+	"""
+	__slots__ = ("radius",)
+
+	def __init__(self, center, radius, strength=1000.0):
+		LightSource.__init__(self, center.x, center.y, center.z, strength)
+		self.radius = float(radius)
+
+	@property
+	def size(self):
+		return self.radius
+
+	def samplepoints(self, p, side, rand):
+		"""
+		Points spread over the light as seen from a point p, in side by side cells of equal area of the disk
+		across the sphere that faces p, each at random within its cell.
+		"""
+		dx,dy,dz = p.x-self.x, p.y-self.y, p.z-self.z
+		mag = sqrt(dx*dx + dy*dy + dz*dz)
+		u,v = _perpendiculars(dx/mag, dy/mag, dz/mag)
+		for i in xrange(side):
+			for j in xrange(side):
+				r = self.radius * sqrt((i+rand.random())/side)
+				angle = 2*pi*(j+rand.random())/side
+				a,b = r*math.cos(angle), r*math.sin(angle)
+				yield (self.x + u[0]*a + v[0]*b, self.y + u[1]*a + v[1]*b, self.z + u[2]*a + v[2]*b)
+
+	def samplearray(self, points, side, rand):
+		"""
+		The array version of samplepoints, for each of an (n,3) array of points, as an (n,side*side,3) array.
+		"""
+		facing = points - _vecarray(self)
+		facing /= numpy.sqrt((facing*facing).sum(axis=1))[:,None]
+		u,v = _perpendicularsarray(facing)
+		i,j = numpy.divmod(numpy.arange(side*side), side)
+		r = self.radius * numpy.sqrt((i + rand.random_sample((len(points),side*side)))/side)
+		angle = 2*pi*(j + rand.random_sample((len(points),side*side)))/side
+		a,b = r*numpy.cos(angle), r*numpy.sin(angle)
+		return _vecarray(self) + u[:,None,:]*a[:,:,None] + v[:,None,:]*b[:,:,None]
+
+class RectangleLight(LightSource):
+	"""
+	A rectangular area light, eg a window or a ceiling panel, casting soft shadows. Shines in all
+	directions from the points of its surface, with the same total strength as a point light at its center.
+
+	- point: a vector instance of the center of the light
+	- normal: a vector instance of the direction the rectangle faces
+	- width/height: the size of the rectangle, the width running along the horizontal xy plane unless the rectangle faces straight up or down
+	- *strength: how bright the light is, see LightSource
+	"""
+	__slots__ = ("u", "v", "size")
+
+	def __init__(self, point, normal, width, height, strength=1000.0):
+		LightSource.__init__(self, point.x, point.y, point.z, strength)
+		n = Vector(normal.x, normal.y, normal.z).normalize_()
+		#the half width and half height sides of the rectangle from its center
+		if abs(n.z) < 0.999:
+			ux,uy = -n.y,n.x
+			mag = sqrt(ux*ux + uy*uy)
+			u = _vector(ux/mag, uy/mag, 0.0)
+		else:
+			u = _vector(1.0, 0.0, 0.0)
+		v = _vector(n.y*u.z-n.z*u.y, n.z*u.x-n.x*u.z, n.x*u.y-n.y*u.x)
+		self.u = u.imul(width/2.0)
+		self.v = v.imul(height/2.0)
+		self.size = sqrt(width**2 + height**2)/2.0
+
+	def samplepoints(self, p, side, rand):
+		"""
+		Points spread over the light, in side by side cells of equal area, each at random within its cell.
+		"""
+		u,v = self.u,self.v
+		for i in xrange(side):
+			for j in xrange(side):
+				a = 2*(i+rand.random())/side - 1
+				b = 2*(j+rand.random())/side - 1
+				yield (self.x + u.x*a + v.x*b, self.y + u.y*a + v.y*b, self.z + u.z*a + v.z*b)
+
+	def samplearray(self, points, side, rand):
+		"""
+		The array version of samplepoints, for each of an (n,3) array of points, as an (n,side*side,3) array.
+		"""
+		i,j = numpy.divmod(numpy.arange(side*side), side)
+		a = 2*(i + rand.random_sample((len(points),side*side)))/side - 1
+		b = 2*(j + rand.random_sample((len(points),side*side)))/side - 1
+		return _vecarray(self) + _vecarray(self.u)*a[:,:,None] + _vecarray(self.v)*b[:,:,None]
 
 class Camera:
 	"""
@@ -411,55 +3393,242 @@ class Camera:
 		self.xangle = xangle
 		self.yangle = yangle
 
-def renderScene(camera, lightSource, objs, imagedims, savepath):
+	def raydirections(self, imagedims):
+		"""
+		The normalized direction and spread of the ray through each pixel, as a flat float array
+		with 4 values (dx,dy,dz,spread) per pixel, row by row from the top of the image. Computed
+		once and reused for as long as the camera position, zoom, angles and image size stay the same.
+		"""
+		pos = self.pos
+		key = (pos.x, pos.y, pos.z, self.zoom, self.xangle, self.yangle, tuple(imagedims))
+		cached = getattr(self, "_raydirections", None)
+		if cached is not None and cached[0] == key:
+			return cached[1]
+		imgwidth,imgheight = imagedims
+		if numpy is not None:
+			#the top image row is the highest y
+			ys,xs = numpy.mgrid[imgheight-1:-1:-1, 0:imgwidth]
+			grid = numpy.empty((imgheight*imgwidth,4))
+			grid[:,0] = xs.ravel()/self.zoom + self.xangle - pos.x
+			grid[:,1] = ys.ravel()/self.zoom + self.yangle - pos.y
+			grid[:,2] = 0 - pos.z
+			lengths = numpy.sqrt((grid[:,:3]**2).sum(axis=1))
+			grid[:,:3] /= lengths[:,None]
+			#pixels are 1/zoom apart where the rays pass z=0
+			grid[:,3] = 1.0 / (self.zoom*lengths)
+			directions = array("d", grid.ravel())
+		else:
+			directions = array("d")
+			for y in xrange(imgheight-1,-1,-1):
+				for x in xrange(imgwidth):
+					direction = Vector(x/self.zoom+self.xangle,y/self.zoom+self.yangle,0).isub(pos)
+					#pixels are 1/zoom apart where the rays pass z=0
+					spread = 1.0/(self.zoom*direction.magnitude())
+					direction.normalize_()
+					directions.extend((direction.x, direction.y, direction.z, spread))
+		self._raydirections = (key, directions)
+		return directions
+
+	def project(self, point):
+		"""
+		The x,y pixel position (y going upwards) at which a point is seen, or None if the point is not in front of the camera.
+		"""
+		pos = self.pos
+		if point.z == pos.z:
+			return None
+		scale = pos.z / (pos.z - point.z)
+		if scale <= 0:
+			return None
+		x = pos.x + (point.x - pos.x)*scale
+		y = pos.y + (point.y - pos.y)*scale
+		return ((x-self.xangle)*self.zoom, (y-self.yangle)*self.zoom)
+
+class Framebuffer( object ):
+	"""
+	A flat buffer of RGB bytes that rendered pixels are written into and then handed to PIL in one go.
+	Can be given to several renders of the same image size so the buffer is only allocated once.
+
+	- imagedims: the image width and height
+	"""
+	def __init__(self, imagedims):
+		self.width, self.height = imagedims
+		self.data = bytearray(self.width*self.height*3)
+
+	def array(self):
+		"""
+		A (height,width,3) numpy view of the buffer, writing to it writes to the buffer.
+		"""
+		return numpy.frombuffer(self.data, dtype=numpy.uint8).reshape(self.height,self.width,3)
+
+	def paste(self, tile, data):
+		"""
+		Writes the RGB bytes of a tile (x1,y1,x2,y2) into the buffer.
+		"""
+		x1,y1,x2,y2 = tile
+		rowsize = 3*(x2-x1)
+		for row in xrange(y2-y1):
+			i = 3*((y1+row)*self.width + x1)
+			self.data[i:i+rowsize] = data[row*rowsize:(row+1)*rowsize]
+
+	def toimage(self):
+		return PIL.Image.frombuffer("RGB", (self.width,self.height), self.data, "raw", "RGB", 0, 1)
+
+def renderScene(camera, lightSource, objs, imagedims, savepath, accelerator="bvh", backend="python", workers=1, tilesize=32, framebuffer=None, stats=False, heatmap=None):
         """
         Renders the scene, given the following:
 
         - a camera instance
-        - a lightsource instance
+        - a lightsource instance, or a list of them
         - a list of geometry object instances
         - image dimensions
         - and the savepath with file extension of where to save the rendered image
+        - *accelerator: "bvh" to build a bounding volume hierarchy over the geometries before rendering (faster for many geometries), "grid" to build a uniform grid (often faster for many evenly spread geometries of similar size), or None to test every geometry for every ray
+        - *backend: "python" to trace one pixel at a time, or "numpy" to trace all pixels at once as arrays (much faster, requires numpy, and raises a ValueError for geometries without array methods, eg triangle meshes and voxel octrees)
+        - *workers: the nr of processes to render with, split into square image tiles. 1 renders everything in this process, None uses all cpu cores
+        - *tilesize: the width and height in pixels of each tile when rendering with several workers
+        - *framebuffer: a framebuffer instance of the same image dimensions to render into, to avoid allocating a new one
+        - *stats: if True, counts the rays, intersection tests and texture lookups made and times each phase of the render, and returns them as a RenderStats instance
+        - *heatmap: the savepath with file extension of where to save a false color image of the nr of intersection tests made for each pixel, from blue for none to red for the most. The raw counts are saved next to it with a .raw extension, as 32 bit unsigned ints row by row from the top, and given as pixelcosts of the stats
         """
+        global _stats
         imgwidth,imgheight = imagedims
-        img = PIL.Image.new("RGB",imagedims)
+        if framebuffer is None:
+                framebuffer = Framebuffer(imagedims)
+        elif (framebuffer.width,framebuffer.height) != tuple(imagedims):
+                raise ValueError("framebuffer dimensions must be the same as the image dimensions")
         #objs.append( LightBulb(lightSource, 0.2, Vector(*white)) )
+        lights = _lights(lightSource)
+        if backend == "numpy":
+                _checkarrays(objs)
         print ("rendering 3D scene")
-        t=time.clock()
-        for x in xrange(imgwidth):
-                #print x
-                for y in xrange(imgheight):
-                        ray = Ray( camera.pos, (Vector(x/camera.zoom+camera.xangle,y/camera.zoom+camera.yangle,0)-camera.pos).normal())
-                        col = trace(ray, objs, lightSource, 10)
-                        img.putpixel((x,imgheight-1-y),gammaCorrection(col,GAMMA_CORRECTION))
-        print ("time taken", time.clock()-t)
-        img.save(savepath)
-
-def renderAnimation(camera, lightSource, staticobjs, animobjs, imagedims, savepath, saveformat):
+        t=timer()
+        if workers is None:
+                workers = multiprocessing.cpu_count()
+        #the per pixel costs are counted from the stats
+        _stats = RenderStats() if stats or heatmap else None
+        costs = array(COSTS_TYPECODE, [0]) * (imgwidth*imgheight) if heatmap else None
+        try:
+                tiles = _scheduletiles(camera, objs, imagedims, tilesize) if workers > 1 else [(0,0,imgwidth,imgheight)]
+                if _stats is not None: _stats.addtime("setup", timer()-t)
+                _renderframe(camera, lights, objs, imagedims, tiles, framebuffer, accelerator, backend, workers, costs=costs)
+                print ("time taken", timer()-t)
+                t=timer()
+                #encoded in memory first, so that compressing the image and writing the file are timed apart
+                data = _encodeimage(framebuffer.toimage(), savepath)
+                if _stats is not None: _stats.addtime("encode", timer()-t)
+                t=timer()
+                with open(savepath, "wb") as writer:
+                        writer.write(data)
+                if _stats is not None: _stats.addtime("save", timer()-t)
+                if heatmap:
+                        _heatmap(costs, imagedims).save(heatmap)
+                        with open(os.path.splitext(heatmap)[0]+".raw", "wb") as writer:
+                                costs.tofile(writer)
+                        _stats.pixelcosts = costs
+                if stats:
+                        return _stats
+        finally:
+                _stats = None
+
+def renderFrames(camera, lightSource, staticobjs, animobjs, imagedims, incremental=False, tilesize=32, workers=1, backend="python"):
+        """
+        Renders the frames of an animation one after another, yielding each frame image in order
+        as soon as it is done, eg for saving or encoding to a video. Given the following:
+
+        - a camera instance
+        - a lightsource instance, or a list of them
+        - a list of *static* geometry object instances (ie those that will not be moving)
+        - a list of animated object instances (ie that will change for every picture frame), the animation is as long as the shortest of them
+        - image dimensions
+        - *incremental: if True, after the first frame only rerenders the image tiles that the animated objects or their shadows may have changed, and keeps the rest of the previous frame. Requires that the camera and light stay in place, and only works with 1 worker. Frames are still rerendered in full if any geometry mirrors or lets through light, as the animated objects may then be seen anywhere.
+        - *tilesize: the width and height in pixels of the tiles to rerender when incremental
+        - *workers: the nr of processes to render with, each rendering whole frames. None uses all cpu cores
+        - *backend: "python" or "numpy", see renderScene
+        """
+        imgwidth,imgheight = imagedims
+        if workers is None:
+                workers = multiprocessing.cpu_count()
+        if incremental and workers > 1:
+                raise ValueError("incremental rendering needs each frame before the next, so can only use 1 worker")
+        framecount = min(len(animobj) for animobj in animobjs) if animobjs else 1
+        lights = _lights(lightSource)
+        if backend == "numpy":
+                _checkarrays(list(staticobjs) + [obj for animobj in animobjs for obj in animobj])
+        camera.raydirections(imagedims)
+        static = list(staticobjs)
+        #the hierarchy over the geometries is only built once, and then refitted around the animated ones
+        bvh = []
+        if workers > 1:
+                #built once here for the first frame, and sent to each worker to refit to the frames it renders
+                _framegeometries(static + [animobj[0] for animobj in animobjs], backend, bvh)
+                pool = multiprocessing.Pool(workers, _initframeworker, ((camera, lights, static, imagedims, backend, bvh),))
+                finished = False
+                try:
+                        frames = ([animobj[frame] for animobj in animobjs] for frame in xrange(framecount))
+                        for data in pool.imap(_workerframe, frames, chunksize=1):
+                                yield PIL.Image.frombuffer("RGB", imagedims, data, "raw", "RGB", 0, 1)
+                        finished = True
+                finally:
+                        #if the frames stop being read, or rendering fails, the frames still queued are dropped instead of waited for
+                        if finished:
+                                pool.close()
+                        else:
+                                pool.terminate()
+                        pool.join()
+                return
+        framebuffer = Framebuffer(imagedims)
+        tiles = _scheduletiles(camera, [], imagedims, tilesize) if incremental else [(0,0,imgwidth,imgheight)]
+        #the points seen by each pixel in the last frame, to find where shadows may have moved
+        hitpoints = array("d", [0.0]) * (3*imgwidth*imgheight) if incremental else None
+        #reflections and refractions of the animated objects can be seen outside the tiles they are in
+        mirrored = incremental and (_mirrors(static) or any(_mirrors(animobj) for animobj in animobjs))
+        for frame in xrange(framecount):
+                print ("frame",frame)
+                t=timer()
+                objs = _framegeometries(static + [animobj[frame] for animobj in animobjs], backend, bvh)
+                dirty = tiles
+                if incremental and frame > 0:
+                        boxes = []
+                        for animobj in animobjs:
+                                if animobj[frame] is not animobj[frame-1]:
+                                        boxes.extend([animobj[frame-1].bbox(), animobj[frame].bbox()])
+                        #moving infinite geometries can change anything
+                        if None not in boxes and not mirrored:
+                                dirty = _dirtytiles(camera, lights, boxes, imagedims, tiles, hitpoints)
+                        print ("rerendering %s of %s tiles" % (len(dirty), len(tiles)))
+                _renderframe(camera, lights, objs, imagedims, dirty, framebuffer, None, backend, 1, hitpoints)
+                print ("time taken", timer()-t)
+                yield framebuffer.toimage()
+
+def renderAnimation(camera, lightSource, staticobjs, animobjs, imagedims, savepath, saveformat, incremental=False, tilesize=32, workers=1, backend="python"):
         """
         Renders the scene, given the following:
 
         - a camera instance
-        - a lightsource instance
+        - a lightsource instance, or a list of them
         - a list of *static* geometry object instances (ie those that will not be moving)
-        - a list of animated object instances (ie that will change for every picture frame)
+        - a list of animated object instances (ie that will change for every picture frame), the animation is as long as the shortest of them
         - image dimensions
         - the savepath (with filename but without file extension) of where to save the rendered image
         - the image format extension to use when saving (should have a dot, eg ".png")
+        - *incremental: if True, after the first frame only rerenders the image tiles that the animated objects or their shadows may have changed, and keeps the rest of the previous frame. Requires that the camera and light stay in place, and only works with 1 worker. Frames are still rerendered in full if any geometry mirrors or lets through light, as the animated objects may then be seen anywhere.
+        - *tilesize: the width and height in pixels of the tiles to rerender when incremental
+        - *workers: the nr of processes to render with, each rendering whole frames. None uses all cpu cores
+        - *backend: "python" or "numpy", see renderScene
         """
-        frame = 0
-        while True:
-                print ("frame",frame)
-                timesavepath = savepath+"_"+str(frame)+saveformat
-                objs = []
-                objs.extend(staticobjs)
-                objs.extend([animobj[frame] for animobj in animobjs])
-                renderScene(camera, lightSource, objs, imagedims, timesavepath)
-                frame += 1
+        frames = renderFrames(camera, lightSource, staticobjs, animobjs, imagedims, incremental, tilesize, workers, backend)
+        for frame,img in enumerate(frames):
+                img.save(savepath+"_"+str(frame)+saveformat)
 
 #SOME LIGHTNING OPTIONS
 AMBIENT = 0.05 #daylight/nighttime
+MAX_RECURSION = 10 #how many times rays may spawn new rays
 GAMMA_CORRECTION = 1/2.2 #lightsource strength?
+ROULETTE_THROUGHPUT = 0.05 #reflected or refracted rays adding less than this fraction of a pixel's color are only followed at random
+LIGHT_CUTOFF = 0.001 #lights that can light up a surface less than this are left out
+LIGHT_SAMPLES = 8 #where more lights than this light up a surface, only this many are sampled
+SHADOW_SAMPLES = 2 #area lights are first sampled with a grid of this many by this many shadow rays
+PENUMBRA_SAMPLES = 4 #and where those disagree with a further grid of this many by this many
 
 #COLORS
 red = (255,0,0)
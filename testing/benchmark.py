@@ -0,0 +1,260 @@
+"""
+Benchmarks the renderer on a fixed set of reproducible scenes: the origtest,
+normaltest and animtest scenes from py3d's own tests, and stress scenes of
+10, 100, 1000 and 10000 randomly placed spheres.
+
+For each scene reports the primary rays per second, the milliseconds per frame,
+the nr of primitive intersection tests per primary ray, and the peak memory
+allocated by python while rendering. Results are written as JSON, and can be
+compared against a stored baseline to catch performance regressions.
+
+Usage:
+
+    python benchmark.py [--scenes origtest,spheres100] [--backend numpy]
+                        [--output results.json] [--baseline baseline.json]
+                        [--update-baseline] [--tolerance 0.2]
+
+Exits with status 1 if any scene got slower than the baseline by more than the tolerance.
+"""
+
+from __future__ import print_function
+
+import sys
+import os
+import json
+import random
+import platform
+import argparse
+
+TESTINGFOLDER = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTINGFOLDER))
+import py3d
+from py3d import *
+
+try:
+        import tracemalloc
+except ImportError:
+        tracemalloc = None
+
+TEXTURE = os.path.join(TESTINGFOLDER, "textures", "spheretexture.gif")
+BASELINE = os.path.join(TESTINGFOLDER, "results", "benchmark_baseline.json")
+
+#SCENES
+#each returns camera, lightsource, static objects, animated objects, and image dimensions
+
+def origtest():
+        objs = []
+        objs.append(Sphere( Vector(-2,0,-10), 2, Vector(*green)))
+        objs.append(Sphere( Vector(2,0,-10), 3.5, Vector(*red)))
+        objs.append(Sphere( Vector(0,-4,-10), 3, Vector(*blue)))
+        objs.append(Plane( Vector(0,0,-12), Vector(0,0,1), Vector(*grey)))
+        return Camera(Vector(0,0,20)), LightSource(0,10,0), objs, [], (500,500)
+
+def normaltest():
+        objs = []
+        objs.append(Sphere( Vector(-2, -2, 1), 1, Color(*blue), texture=TEXTURE, spintop=Vector(1,0,0), facing=Vector(0,1,0)))
+        objs.append(Rectangle( Vector(-3,-3,0), Vector(-4, -2, 2), width=2, height=2, color=Vector(*yellow)))
+        return Camera(Vector(-1,-1,20)), LightSource(-4, -2, 8), objs, [], (200,200)
+
+def animtest():
+        staticobjs = []
+        staticobjs.append(Sphere( Vector(-4, -2, 1), 1, Color(*red), texture=TEXTURE, spintop=Vector(1,0,0), facing=Vector(0,1,0)))
+        staticobjs.append(Sphere( Vector(-2, -4, 1), 1, Color(*green), texture=TEXTURE, spintop=Vector(0,1,0), facing=Vector(0,0,1)))
+        staticobjs.append(Plane( Vector(0,0,0), Vector(0,0,1), Vector(*purple)))
+        fallingball = AnimatedObject(Sphere( Vector(-2, -2, 20), 1, Vector(*yellow), texture=TEXTURE, facing=Vector(1,0,0)),
+                                     Sphere( Vector(-2, -2, 15), 1, Vector(*yellow), texture=TEXTURE, facing=Vector(1,0,0)),
+                                     Sphere( Vector(-2, -2, 9), 1, Vector(*yellow), texture=TEXTURE, facing=Vector(0.7,0.3,0)),
+                                     Sphere( Vector(-2, -2, 5), 1, Vector(*yellow), texture=TEXTURE, facing=Vector(0.4,0.6,0)),
+                                     Sphere( Vector(-2, -2, 1), 1, Vector(*yellow), texture=TEXTURE, facing=Vector(0.1,0.9,0)) )
+        return Camera(Vector(0,0,30)), LightSource(-4,-4,10), staticobjs, [fallingball], (200,200)
+
+def spheres(count):
+        """
+        A stress scene of count spheres scattered over a ground plane, always the same for the same count.
+        """
+        def scene():
+                rand = random.Random(count)
+                colors = [red, yellow, green, blue, grey, white, purple]
+                #spread them over a square so they cover about the same image area at any count
+                size = 10.0
+                radius = size / count**0.5 * 0.4
+                objs = []
+                for _ in range(count):
+                        center = Vector(rand.uniform(-size,size), rand.uniform(-size,size), rand.uniform(0,size/2.0))
+                        objs.append(Sphere(center, radius*rand.uniform(0.5,1.5), Color(*rand.choice(colors))))
+                objs.append(Plane( Vector(0,0,-1), Vector(0,0,1), Vector(*grey)))
+                return Camera(Vector(0,0,30)), LightSource(0,-20,30), objs, [], (200,200)
+        return scene
+
+SCENES = [("origtest", origtest),
+          ("normaltest", normaltest),
+          ("animtest", animtest),
+          ("spheres10", spheres(10)),
+          ("spheres100", spheres(100)),
+          ("spheres1000", spheres(1000)),
+          ("spheres10000", spheres(10000))]
+
+#MEASURING
+
+class _Quiet(object):
+        "Silences the progress printing of the renderer."
+        def __enter__(self):
+                self.stdout = sys.stdout
+                sys.stdout = open(os.devnull, "w")
+        def __exit__(self, *exc):
+                sys.stdout.close()
+                sys.stdout = self.stdout
+
+def _render(scene, backend, workers):
+        camera,lightSource,staticobjs,animobjs,imagedims = scene
+        with _Quiet():
+                frames = 0
+                for img in renderFrames(camera, lightSource, staticobjs, animobjs, imagedims, workers=workers, backend=backend):
+                        frames += 1
+        return frames
+
+def _geometryclasses():
+        "The geometry classes of py3d that intersect rays themselves, ie not accelerators."
+        accelerators = tuple(py3d.ACCELERATORS.values())
+        classes = []
+        for value in vars(py3d).values():
+                if isinstance(value, type) and value not in accelerators and ("hit" in vars(value) or "hitarray" in vars(value)):
+                        classes.append(value)
+        return classes
+
+def _counttests(scenefunc, backend):
+        """
+        Renders a scene once with every primitive intersection test counted, returning the count per
+        geometry type. Tests made by worker processes cannot be counted, so always renders in-process.
+        """
+        counts = dict()
+        originals = []
+        def counting(cls, name, method, many):
+                def wrapper(self, *args):
+                        #subclasses calling their parent's test only count once
+                        if type(self) is cls:
+                                counts[cls.__name__] = counts.get(cls.__name__, 0) + (len(args[0]) if many else 1)
+                        return method(self, *args)
+                return wrapper
+        for cls in _geometryclasses():
+                for name,many in (("hit",False), ("hitarray",True)):
+                        if name in vars(cls):
+                                method = vars(cls)[name]
+                                originals.append((cls, name, method))
+                                setattr(cls, name, counting(cls, name, method, many))
+        try:
+                _render(scenefunc(), backend, 1)
+        finally:
+                for cls,name,method in originals:
+                        setattr(cls, name, method)
+        return counts
+
+def _peakmemory(scenefunc, backend):
+        "The peak memory in bytes allocated by python while building and rendering a scene, or None if it cannot be measured."
+        if tracemalloc is None:
+                return None
+        tracemalloc.start()
+        try:
+                _render(scenefunc(), backend, 1)
+                return tracemalloc.get_traced_memory()[1]
+        finally:
+                tracemalloc.stop()
+
+def benchmark(name, scenefunc, backend="python", workers=1, repeat=3):
+        """
+        Benchmarks a single scene, returning a dict of its results. The time is the best of several renders.
+        """
+        best = None
+        for _ in range(repeat):
+                scene = scenefunc()
+                t = timer()
+                frames = _render(scene, backend, workers)
+                elapsed = timer()-t
+                if best is None or elapsed < best:
+                        best = elapsed
+        camera,lightSource,staticobjs,animobjs,imagedims = scenefunc()
+        rays = imagedims[0] * imagedims[1] * frames
+        counts = _counttests(scenefunc, backend)
+        return {"frames": frames,
+                "imagedims": list(imagedims),
+                "geometries": len(staticobjs) + len(animobjs),
+                "seconds": best,
+                "ms_per_frame": 1000.0 * best / frames,
+                "rays_per_sec": rays / best,
+                "tests_per_ray": sum(counts.values()) / float(rays),
+                "tests_per_type": counts,
+                "peak_memory": _peakmemory(scenefunc, backend)}
+
+def compare(results, baseline, tolerance):
+        """
+        Compares results against baseline results, returning a list of (scene, measure, baseline value,
+        new value) for measures that got worse by more than the tolerance fraction.
+        """
+        regressions = []
+        for name,result in sorted(results["scenes"].items()):
+                old = baseline["scenes"].get(name)
+                if old is None:
+                        continue
+                for measure in ("ms_per_frame", "tests_per_ray", "peak_memory"):
+                        if result.get(measure) is not None and old.get(measure):
+                                if result[measure] > old[measure] * (1+tolerance):
+                                        regressions.append((name, measure, old[measure], result[measure]))
+        return regressions
+
+def main(args=None):
+        parser = argparse.ArgumentParser(description="Benchmarks py3d rendering on reproducible scenes.")
+        parser.add_argument("--scenes", help="comma separated names of the scenes to run (default all): %s" % ",".join(name for name,_ in SCENES))
+        parser.add_argument("--backend", default="python", help="the rendering backend, python or numpy")
+        parser.add_argument("--workers", type=int, default=1, help="the nr of processes to render with")
+        parser.add_argument("--repeat", type=int, default=3, help="renders each scene this many times and keeps the fastest")
+        parser.add_argument("--output", help="path of the json file to write the results to")
+        parser.add_argument("--baseline", default=BASELINE, help="path of the json baseline results to compare against")
+        parser.add_argument("--update-baseline", action="store_true", help="store the results as the new baseline")
+        parser.add_argument("--tolerance", type=float, default=0.2, help="how much worse than the baseline a measure may get, as a fraction")
+        args = parser.parse_args(args)
+
+        names = args.scenes.split(",") if args.scenes else [name for name,_ in SCENES]
+        scenes = dict(SCENES)
+        for name in names:
+                if name not in scenes:
+                        parser.error("unknown scene: %s" % name)
+
+        results = {"python": platform.python_version(),
+                   "platform": platform.platform(),
+                   "backend": args.backend,
+                   "workers": args.workers,
+                   "scenes": dict()}
+        print ("%-14s %10s %12s %12s %14s" % ("scene", "ms/frame", "rays/sec", "tests/ray", "peak memory"))
+        for name in names:
+                result = benchmark(name, scenes[name], args.backend, args.workers, args.repeat)
+                results["scenes"][name] = result
+                memory = "%.1f MB" % (result["peak_memory"]/1e6) if result["peak_memory"] is not None else "-"
+                print ("%-14s %10.1f %12.0f %12.2f %14s" % (name, result["ms_per_frame"], result["rays_per_sec"], result["tests_per_ray"], memory))
+
+        if args.output:
+                with open(args.output, "w") as writer:
+                        json.dump(results, writer, indent=4, sort_keys=True)
+
+        failed = False
+        if args.update_baseline:
+                with open(args.baseline, "w") as writer:
+                        json.dump(results, writer, indent=4, sort_keys=True)
+                print ("stored as new baseline: %s" % args.baseline)
+        elif os.path.exists(args.baseline):
+                with open(args.baseline) as reader:
+                        baseline = json.load(reader)
+                if (baseline.get("backend"),baseline.get("workers")) != (args.backend,args.workers):
+                        print ("baseline was run with another backend or nr of workers, not comparing")
+                else:
+                        regressions = compare(results, baseline, args.tolerance)
+                        for name,measure,old,new in regressions:
+                                print ("REGRESSION %s %s: %s -> %s" % (name, measure, old, new))
+                        if not regressions:
+                                print ("no regressions against baseline: %s" % args.baseline)
+                        failed = bool(regressions)
+        else:
+                print ("no baseline found at %s, not comparing (store one with --update-baseline)" % args.baseline)
+        return 1 if failed else 0
+
+if __name__ == "__main__":
+        sys.exit(main())
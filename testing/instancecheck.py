@@ -0,0 +1,71 @@
+"""
+Checks that an instance of a textured sphere, scaled up by its transform, renders like a
+real sphere of the same size, with both backends. The texture is sampled from mipmap levels
+picked by how much surface each pixel covers, so this fails if that width is not scaled into
+the coordinates of the instanced geometry.
+
+Usage:
+
+    python instancecheck.py [--size 120] [--tolerance 2]
+
+Prints how many pixels differ by more than the tolerance, and exits with status 1 if any do.
+"""
+
+from __future__ import print_function
+
+import sys
+import os
+import shutil
+import tempfile
+import argparse
+
+TESTINGFOLDER = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTINGFOLDER))
+from py3d import *
+
+TEXTURE = os.path.join(TESTINGFOLDER, "textures", "spheretexture.gif")
+
+def scenes():
+        "A real sphere of radius 3, and an instance of a sphere of radius 0.5 scaled 6 times to the same place."
+        camera = Camera(Vector(0,0,40), zoom=4)
+        lights = [LightSource(10,-10,30,strength=3000.0)]
+        real = Sphere(Vector(1,-1,3), 3, Color(*white), texture=TEXTURE, spintop=Vector(0,0,1), facing=Vector(1,0,0))
+        small = Sphere(Vector(0,0,0), 0.5, Color(*white), texture=TEXTURE, spintop=Vector(0,0,1), facing=Vector(1,0,0))
+        instance = Instance(small, Matrix4.new_translate(1,-1,3) * Matrix4.new_scale(6,6,6))
+        return (camera, lights, [real]), (camera, lights, [instance])
+
+def differing(first, second, tolerance):
+        "The nr of pixels of two images where any band differs by more than the tolerance."
+        first = bytearray(PIL.Image.open(first).convert("RGB").tobytes())
+        second = bytearray(PIL.Image.open(second).convert("RGB").tobytes())
+        count = 0
+        for i in range(0, len(first), 3):
+                if max(abs(first[i+band]-second[i+band]) for band in range(3)) > tolerance:
+                        count += 1
+        return count
+
+def main(args=None):
+        parser = argparse.ArgumentParser(description="Checks that scaled instances of textured spheres render like real spheres.")
+        parser.add_argument("--size", type=int, default=120, help="the width and height of the images")
+        parser.add_argument("--tolerance", type=int, default=2, help="how much a pixel band may differ")
+        args = parser.parse_args(args)
+
+        real,instanced = scenes()
+        folder = tempfile.mkdtemp()
+        try:
+                failed = False
+                for backend in ("python", "numpy"):
+                        images = []
+                        for name,(camera,lights,objs) in (("real",real), ("instanced",instanced)):
+                                imagepath = os.path.join(folder, "%s_%s.png" % (backend, name))
+                                renderScene(camera, lights, objs, (args.size,args.size), imagepath, backend=backend, accelerator=None)
+                                images.append(imagepath)
+                        wrong = differing(images[0], images[1], args.tolerance)
+                        print ("%-8s %s pixels differ" % (backend, wrong))
+                        failed = failed or bool(wrong)
+        finally:
+                shutil.rmtree(folder)
+        return 1 if failed else 0
+
+if __name__ == "__main__":
+        sys.exit(main())
@@ -0,0 +1,109 @@
+"""
+Checks that VoxelOctree.hit finds the same hits as VoxelVolume.hit, which it is meant to
+give exactly, for a volume of a hollow sphere, a checkerboard floor and a box. Sends
+random rays along the axes and diagonally through voxel edges and corners from points
+on the voxel grid, random rays starting inside filled voxels, and the rays of a camera,
+through the volume, and through an octree of it both in memory and mapped from a file.
+
+Usage:
+
+    python voxelcheck.py [--rays 20000] [--seed 0]
+
+Prints the rays that hit differently, and exits with status 1 if there are any.
+"""
+
+from __future__ import print_function
+
+import sys
+import os
+import random
+import tempfile
+import argparse
+
+TESTINGFOLDER = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTINGFOLDER))
+from py3d import *
+
+def volume():
+        vol = VoxelVolume(Vector(-5,-5,-5), (40,40,40), 0.25)
+        vol.fillsphere(Vector(0,0,0), 4, Color(*red), thickness=0.5)
+        vol.fillcheckerboard(Vector(-5,-5,-5), Vector(5,5,-4), 1, Color(*white), Color(*grey))
+        vol.fillbox(Vector(1,1,-4), Vector(3,2.5,-1), Color(*blue))
+        return vol
+
+def gridrays(vol, count, rand):
+        "Rays from points on the voxel grid, along the axes or diagonally through voxel edges and corners."
+        nx,ny,nz = vol.dims
+        o,size = vol.origin,vol.voxelsize
+        for _ in range(count):
+                #half of the starts are on voxel borders, the rest in the middle of voxels
+                step = rand.choice((1.0, 0.5))
+                start = Vector(o.x + size*step*rand.randint(-4, int(nx/step)+4),
+                               o.y + size*step*rand.randint(-4, int(ny/step)+4),
+                               o.z + size*step*rand.randint(-4, int(nz/step)+4))
+                axes = rand.choice(((1,0,0), (0,1,0), (0,0,1), (1,1,0), (1,0,1), (0,1,1), (1,1,1)))
+                direction = Vector(*[axis*rand.choice((-1,1)) for axis in axes])
+                yield Ray(start, direction.normal())
+
+def insiderays(vol, count, rand):
+        "Rays in random directions from random points inside filled voxels."
+        nx,ny,nz = vol.dims
+        o,size = vol.origin,vol.voxelsize
+        made = 0
+        while made < count:
+                x,y,z = rand.randrange(nx),rand.randrange(ny),rand.randrange(nz)
+                if not vol.voxel(x,y,z):
+                        continue
+                start = Vector(o.x + size*(x+rand.random()), o.y + size*(y+rand.random()), o.z + size*(z+rand.random()))
+                direction = Vector(rand.gauss(0,1), rand.gauss(0,1), rand.gauss(0,1))
+                made += 1
+                yield Ray(start, direction.normal())
+
+def camerarays(camera, imagedims):
+        "The ray through each pixel of a camera."
+        directions = camera.raydirections(imagedims)
+        for i in range(0, len(directions), 4):
+                yield Ray(camera.pos, Vector(directions[i], directions[i+1], directions[i+2]))
+
+def check(vol, octrees, rays):
+        "Returns the rays that an octree hits differently than the volume, with both distances."
+        wrong = []
+        for ray in rays:
+                expected = vol.hit(ray)
+                for octree in octrees:
+                        found = octree.hit(ray)
+                        if found != expected:
+                                wrong.append((ray, expected, found))
+                                break
+        return wrong
+
+def main(args=None):
+        parser = argparse.ArgumentParser(description="Checks that voxel octrees hit the same as voxel volumes.")
+        parser.add_argument("--rays", type=int, default=20000, help="the nr of random rays of each kind")
+        parser.add_argument("--seed", type=int, default=0, help="the seed of the random rays")
+        args = parser.parse_args(args)
+
+        rand = random.Random(args.seed)
+        vol = volume()
+        octree = VoxelOctree.fromvolume(vol)
+        handle,filepath = tempfile.mkstemp(suffix=".svo")
+        os.close(handle)
+        try:
+                octree.save(filepath)
+                octrees = [octree, VoxelOctree.load(filepath)]
+                failed = False
+                for name,rays in (("grid", gridrays(vol, args.rays, rand)),
+                                  ("inside", insiderays(vol, args.rays, rand)),
+                                  ("camera", camerarays(Camera(Vector(3,2,20),zoom=5,xangle=-6,yangle=-6), (60,60)))):
+                        wrong = check(vol, octrees, rays)
+                        print ("%-8s %s rays hit differently" % (name, len(wrong)))
+                        for ray,expected,found in wrong[:10]:
+                                print ("    from %s towards %s: volume %s, octree %s" % (ray.o, ray.d, expected, found))
+                        failed = failed or bool(wrong)
+                del octrees
+        finally:
+                os.remove(filepath)
+        return 1 if failed else 0
+
+if __name__ == "__main__":
+        sys.exit(main())